@@ -4,21 +4,37 @@ import gspread
 from google.oauth2.service_account import Credentials
 import json
 from datetime import datetime
-import time
 import uuid
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import DATE_FORMAT, SheetsStorage, SQLiteStorage
+from scheduler import Scheduler, ScheduledSpreadsheet, SheetsWriteError
+import perf
+from calc import flow_watts
+from auth import verify_password
+from journal import Journal, WriteBehind
+from export import PREVIEW_ROWS, preview_page, export_csv, export_parquet, parquet_available, summarize
 
 # --- CONFIGURAZIONE ---
 SHEET_NAME = "DB_Respirometria"
 
-# Definiamo le colonne attese per evitare crash su DB vuoti
-EXPECTED_HEADERS = [
-    "ID_Univoco", "Project_Name", "Data", "Operatore", "Temperatura", "Pressione", 
-    "Custom_Tags_JSON", "ID_Animale", "Siringa", "Elettrodo", "Tubo_Pompa", 
-    "Falcon_Set", "Falcon_ID", "Peso_Vuoto", "Peso_Pieno", "Durata_Min", "Flow_Rate", 
-    "SMR_1", "SMR_2", "Delta_Torr", "Watts", "Sex", "Body_Length", "Head_Length", 
-    "Note", "Dry_Weight", "Stato"
-]
+# Secondi di validità della copia in cache di DB_Respirometria (sovrascrivibile da secrets)
+DB_CACHE_TTL = int(st.secrets.get("db_cache_ttl", 60))
+USERS_CACHE_TTL = int(st.secrets.get("users_cache_ttl", 300))
+
+# Quota Sheets: [sheets_quota] per_minute / burst / max_retries
+QUOTA_CFG = st.secrets.get("sheets_quota", {})
+
+# Thread per le letture in parallelo dopo il login (condivisi da tutte le sessioni)
+PREFETCH_WORKERS = int(st.secrets.get("prefetch_workers", 4))
+
+# Utenti che vedono il pannello prestazioni nella sidebar
+ADMIN_USERS = list(st.secrets.get("admin_users", []))
+
+# Backend dati: [storage] backend = "sheets" (default) oppure "sqlite" con sqlite_path;
+# journal_path = file locale dei salvataggi in attesa di invio
+STORAGE_CFG = st.secrets.get("storage", {})
 
 FALCON_DATASETS = {
     "Set Normal": [9.940, 10.108, 10.002, 9.976, 9.955, 9.967, 9.956, 9.979, 9.936, 9.919, 9.997, 9.934],
@@ -26,80 +42,128 @@ FALCON_DATASETS = {
 }
 
 # --- CONNESSIONE ---
+# Una sola autorizzazione per processo: il client gspread riusa la sessione HTTP
+# e rinnova il token da solo. Le eccezioni non vengono messe in cache.
+@st.cache_resource
 def get_connection():
     scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
     creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scope)
     client = gspread.authorize(creds)
     return client.open(SHEET_NAME)
 
+@st.cache_resource
+def get_scheduler():
+    # Condiviso da tutte le sessioni: la quota è per progetto/utente di servizio, non per browser
+    return Scheduler(per_minute=int(QUOTA_CFG.get("per_minute", 60)), burst=int(QUOTA_CFG.get("burst", 15)),
+                     max_retries=int(QUOTA_CFG.get("max_retries", 5)))
+
+@st.cache_resource
+def get_pool():
+    # Pool limitato: un picco di login all'inizio del turno non apre un thread per richiesta
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+@st.cache_resource
+def get_store():
+    if STORAGE_CFG.get("backend", "sheets") == "sqlite":
+        store = SQLiteStorage(STORAGE_CFG.get("sqlite_path", "lab_dashboard.db"))
+    else:
+        store = SheetsStorage(ScheduledSpreadsheet(get_connection(), get_scheduler()), ttl=DB_CACHE_TTL, users_ttl=USERS_CACHE_TTL)
+    store = WriteBehind(store, Journal(STORAGE_CFG.get("journal_path", "lab_dashboard_journal.db")))
+    return perf.Instrumented(store, "store")
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def summary_view(n_rows, version, by, _df):
+    # Chiave: numero di righe, marcatore di modifica dello storage e raggruppamento (il DataFrame non viene hashato)
+    return summarize(_df, list(by))
+
+def write_failed(e):
+    st.error(f"⚠️ Scrittura NON riuscita, i dati non sono stati salvati. Riprova. ({e})")
+    st.stop()
+
+# --- TIMER (fragment) ---
+# Mentre il timer gira si ridisegna solo questo pannello, una volta al secondo e senza chiamate a Sheets:
+# la sessione cloud si legge al login e si scrive solo su START / STOP.
+def timer_panel(set_label, project, saved_min):
+    col_t1, col_t2, col_t3 = st.columns([1,1,2])
+    if 'timer_start' in st.session_state:
+        mins = (datetime.now() - st.session_state.timer_start).total_seconds() / 60
+        col_t3.warning(f"⏱️ IN CORSO: {mins:.2f} min")
+        if col_t2.button("⏹️ STOP TIMER"):
+            try: get_store().clear_session(st.session_state.username)
+            except SheetsWriteError as e: write_failed(e)
+            del st.session_state['timer_start']
+            st.session_state.timer_last = (set_label, mins)
+            st.rerun()
+    else:
+        col_t3.info(f"Ultimo Tempo: {saved_min:.2f} min")
+        if col_t1.button("▶️ START TIMER"):
+            now = datetime.now()
+            try: get_store().save_session(st.session_state.username, now.strftime("%Y-%m-%d %H:%M:%S"), project)
+            except SheetsWriteError as e: write_failed(e)
+            st.session_state.timer_start = now
+            st.rerun()
+
+# --- STATO SALVATAGGI (fragment) ---
+# Righe dell'utente ancora nel journal locale; si aggiorna da solo finché c'è qualcosa in attesa
+def save_status(user):
+    s = get_store().status(user)
+    if s["pending"]: st.warning(f"⏳ {s['pending']} righe in attesa di invio al foglio")
+    else: st.success("✅ Tutto salvato sul foglio")
+    if s["last_error"]: st.caption(f"Invio non riuscito, nuovo tentativo automatico: {s['last_error']}")
+    if s["dead"]:
+        st.error(f"⚠️ {s['dead']} righe non accettate dal foglio")
+        with st.expander("Dettagli"):
+            st.dataframe(pd.DataFrame(get_store().dead(user)), hide_index=True)
+            c1, c2 = st.columns(2)
+            if c1.button("Riprova", key="dead_retry"): get_store().requeue(user); st.rerun(scope="fragment")
+            if c2.button("Scarta", key="dead_drop"): get_store().discard(user); st.rerun(scope="fragment")
+    if s["last_flush"]: st.caption(f"Ultimo invio: {datetime.fromtimestamp(s['last_flush']):%H:%M:%S}")
+
 # --- FIX JSON ---
 def clean_for_json(value):
     if isinstance(value, (np.integer, np.int64)): return int(value)
-    elif isinstance(value, (np.floating, np.float64)): return float(value)
+    elif isinstance(value, (np.floating, np.float64)): return float(str(value))  # float32 senza cifre spurie
     elif isinstance(value, np.ndarray): return value.tolist()
     elif pd.isna(value): return ""
     return value
 
 # --- FUNZIONI DI SUPPORTO ---
-def check_login(username, password, sh):
+def check_login(username, password):
+    # Rubrica in cache: nessuna chiamata di rete nel caso comune. Se la verifica fallisce
+    # si rilegge una volta il foglio (utente nuovo / password cambiata). Utente inesistente e
+    # password errata costano lo stesso numero di verifiche.
     try:
-        ws = sh.worksheet("Users")
-        users = ws.get_all_records()
-        for u in users:
-            if str(u.get('Username', '')).strip() == str(username).strip() and str(u.get('Password', '')).strip() == str(password).strip():
+        store = get_store()
+        for refresh in (False, True):
+            u = store.get_user(username, refresh=refresh)
+            if verify_password(u.get('Password') if u else None, password) and u:
                 return u.get('Nome_Completo', 'Utente')
     except: st.error("Errore foglio Users.")
     return None
 
-def get_project_names(sh):
-    ws = sh.worksheet("DB_Respirometria")
-    try:
-        col_vals = ws.col_values(2) 
-        if len(col_vals) > 1: return sorted(list(set(col_vals[1:])))
-    except: pass
-    return []
-
-def get_all_unique_tags(sh):
-    ws = sh.worksheet("DB_Respirometria")
-    try:
-        raw_data = ws.col_values(7)
-        unique_tags = set()
-        for item in raw_data[1:]:
-            if item and item != "{}":
-                try:
-                    js = json.loads(item)
-                    unique_tags.update(js.keys())
-                except: pass
-        return sorted(list(unique_tags))
-    except: return []
-
-def save_session_state(username, start_time_str, project, sh):
-    ws = sh.worksheet("Active_Sessions")
-    try:
-        cell = ws.find(username)
-        ws.update_cell(cell.row, 2, start_time_str)
-        ws.update_cell(cell.row, 3, project)
-    except: ws.append_row([username, start_time_str, project])
-
-def load_session_state(username, sh):
-    ws = sh.worksheet("Active_Sessions")
-    try:
-        cell = ws.find(username)
-        vals = ws.row_values(cell.row)
-        if len(vals) >= 3: return vals[1], vals[2]
-    except: pass
-    return None, None
-
-def clear_session_state(username, sh):
-    ws = sh.worksheet("Active_Sessions")
-    try:
-        cell = ws.find(username)
-        ws.delete_rows(cell.row)
-    except: pass
+def prefetch(store, username):
+    # Letture indipendenti del primo render lanciate insieme subito dopo l'autenticazione:
+    # si attende la più lenta invece della somma. Tag e sessione timer finiscono in session_state,
+    # progetti e set aperti li usa il primo render dopo il login (session_state.prefetched).
+    stats = perf.current()
+    def job(fn, *args, **kwargs):
+        perf.attach(stats)
+        try: return fn(*args, **kwargs)
+        except Exception: return None  # una lettura fallita verrà rifatta dal render normale
+    pool = get_pool()
+    futures = {
+        "tags": pool.submit(job, store.unique_tags),
+        "projects": pool.submit(job, store.project_names),
+        "session": pool.submit(job, store.load_session, username),
+        "open": pool.submit(job, store.list_records, operatore=username, exclude_stato='ARCHIVIATO'),
+    }
+    return {k: f.result() for k, f in futures.items()}
 
 # --- UI SETUP ---
 st.set_page_config(page_title="Lab Manager V3.1", layout="wide", page_icon="🔬")
 st.title("🔬 Respirometria Lab Manager")
+get_scheduler().begin_rerun()
+perf.begin_rerun(st.session_state, st.session_state.get("username", ""))
 
 if 'logged_in' not in st.session_state: st.session_state.logged_in = False
 if 'username' not in st.session_state: st.session_state.username = ""
@@ -112,26 +176,39 @@ if not st.session_state.logged_in:
         user = st.text_input("Username")
         pwd = st.text_input("Password", type="password")
         if st.form_submit_button("Accedi"):
+            perf.start("login")
             try:
-                sh = get_connection()
-                real_name = check_login(user, pwd, sh)
+                store = get_store()
+                real_name = check_login(user, pwd)
                 if real_name:
                     st.session_state.logged_in = True
                     st.session_state.username = user
                     st.session_state.real_name = real_name
-                    st.session_state.all_possible_tags = get_all_unique_tags(sh)
+                    with perf.section("prefetch"): pre = prefetch(store, user)
+                    st.session_state.all_possible_tags = pre["tags"] or []
+                    cloud_time, _ = pre["session"] or (None, None)
+                    if cloud_time: st.session_state.timer_start = datetime.strptime(cloud_time, "%Y-%m-%d %H:%M:%S")
+                    st.session_state.prefetched = {k: pre[k] for k in ("projects", "open") if pre[k] is not None}
                     st.rerun()
                 else: st.error("Credenziali Errate")
             except Exception as e: st.error(f"Errore Login: {e}")
     st.stop()
 
 # --- 2. LOGICA POST-LOGIN ---
-try: sh = get_connection()
+try: store = get_store()
 except: st.error("Connessione persa."); st.stop()
 
+# Letture già fatte dal prefetch del login: valgono solo per questo render
+prefetched = st.session_state.pop('prefetched', {})
+
 st.sidebar.write(f"Op: **{st.session_state.real_name}**")
+with st.sidebar:
+    pending = store.status(st.session_state.username)["pending"]
+    st.fragment(save_status, run_every=2 if pending else None)(st.session_state.username)
+if 'flash' in st.session_state: st.toast(st.session_state.pop('flash'))
 if st.sidebar.button("Logout"):
     st.session_state.logged_in = False
+    for k in ('timer_start', 'timer_last'): st.session_state.pop(k, None)
     st.rerun()
 
 menu = st.sidebar.radio("Navigazione", ["1. Gestione Esperimenti (Flow/SMR)", "2. Pesi (Day 3)", "3. Export"])
@@ -140,22 +217,16 @@ menu = st.sidebar.radio("Navigazione", ["1. Gestione Esperimenti (Flow/SMR)", "2
 # SEZIONE 1: GESTIONE ESPERIMENTI
 # =============================================================================
 if menu == "1. Gestione Esperimenti (Flow/SMR)":
-    
-    # Check Timer Globale
-    cloud_time, cloud_proj = load_session_state(st.session_state.username, sh)
-    if cloud_time and 'timer_start' not in st.session_state:
-        st.toast(f"Timer sincronizzato: {cloud_time}")
-        st.session_state.timer_start = datetime.strptime(cloud_time, "%Y-%m-%d %H:%M:%S")
 
     tab_new, tab_run = st.tabs(["🆕 Crea Nuovo Set", "▶️ Svolgi / Aggiorna Set"])
 
     # --- TAB A: CREAZIONE ---
-    with tab_new:
+    with tab_new, perf.section("tab_new"):
         st.caption("Usa questo tab SOLO per creare la struttura iniziale.")
         
         c1, c2 = st.columns(2)
         with c1:
-            projs = get_project_names(sh)
+            projs = prefetched["projects"] if "projects" in prefetched else store.project_names()
             mode_p = st.radio("Cartella", ["Esistente", "Nuova"], horizontal=True)
             if mode_p == "Esistente" and projs:
                 proj_name = st.selectbox("Seleziona Cartella", projs)
@@ -179,6 +250,8 @@ if menu == "1. Gestione Esperimenti (Flow/SMR)":
                 if st.form_submit_button("Aggiungi") and new_t:
                     if new_t not in st.session_state.all_possible_tags:
                         st.session_state.all_possible_tags.append(new_t)
+                        try: store.add_to_catalog(tags=[new_t])
+                        except SheetsWriteError as e: st.warning(f"Parametro non salvato nel catalogo: {e}")
                     if new_t not in st.session_state.active_tags:
                         st.session_state.active_tags.append(new_t)
                         st.rerun()
@@ -199,7 +272,6 @@ if menu == "1. Gestione Esperimenti (Flow/SMR)":
         if st.button("💾 CREA STRUTTURA", type="primary"):
             if not proj_name: st.error("Nome progetto mancante"); st.stop()
             
-            ws_db = sh.worksheet("DB_Respirometria")
             rows = []
             now_str = datetime.now().strftime("%Y-%m-%d")
             json_tags = json.dumps(dyn_vals)
@@ -216,69 +288,43 @@ if menu == "1. Gestione Esperimenti (Flow/SMR)":
                 ]
                 rows.append(new_row)
             
-            ws_db.append_rows(rows)
+            try: store.append_rows(rows)
+            except SheetsWriteError as e: write_failed(e)
+            try: store.add_to_catalog(projects=[proj_name], tags=list(dyn_vals))
+            except SheetsWriteError as e: st.warning(f"Catalogo non aggiornato: {e}")
             st.success(f"Creati {num_animali} slot. Vai al tab 'Svolgi'!")
 
     # --- TAB B: SVOLGIMENTO ---
-    with tab_run:
-        ws_db = sh.worksheet("DB_Respirometria")
-        all_data = ws_db.get_all_records()
-        
-        # --- FIX SICUREZZA PER DATABASE VUOTO ---
-        if not all_data:
-            # Se è vuoto, creiamo un DF vuoto ma con le colonne giuste per evitare KeyError
-            df = pd.DataFrame(columns=EXPECTED_HEADERS)
-        else:
-            df = pd.DataFrame(all_data)
-            # Controllo extra se per caso gspread ha letto qualcosa ma le colonne mancano
-            for col in ['Operatore', 'Stato', 'Project_Name']:
-                if col not in df.columns:
-                    df[col] = "" # Crea colonna vuota per non crashare
-
-        # 1. Filtro Selezione Esperimento
-        # Ora siamo sicuri che le colonne 'Operatore' e 'Stato' esistono
-        my_open = df[ (df['Operatore'] == st.session_state.username) & (df['Stato'] != 'ARCHIVIATO') ].copy()
+    with tab_run, perf.section("tab_run"):
+        # 1. Filtro Selezione Esperimento (query filtrata lato backend)
+        my_open = prefetched["open"] if "open" in prefetched else \
+            store.list_records(operatore=st.session_state.username, exclude_stato='ARCHIVIATO')
         
         if my_open.empty:
             st.info("Nessun esperimento attivo trovato. Vai su 'Crea Nuovo Set'.")
         else:
-            my_open['Label'] = my_open['Project_Name'] + " (" + my_open['Data'] + ") - " + my_open['Stato']
             unique_sets = my_open[['Project_Name', 'Data', 'Stato']].drop_duplicates()
-            unique_sets['Label'] = unique_sets['Project_Name'] + " (" + unique_sets['Data'] + ") - " + unique_sets['Stato']
+            unique_sets['Label'] = (unique_sets['Project_Name'].astype(str) + " (" + unique_sets['Data'].dt.strftime(DATE_FORMAT).fillna("")
+                                    + ") - " + unique_sets['Stato'].astype(str))
             
             selected_label = st.selectbox("Seleziona Esperimento:", unique_sets['Label'].tolist())
             
             current_set_info = unique_sets[unique_sets['Label'] == selected_label].iloc[0]
-            current_df = my_open[ 
-                (my_open['Project_Name'] == current_set_info['Project_Name']) & 
-                (my_open['Data'] == current_set_info['Data']) 
-            ].copy()
+            same_day = my_open['Data'].isna() if pd.isna(current_set_info['Data']) else my_open['Data'] == current_set_info['Data']
+            current_df = my_open[(my_open['Project_Name'] == current_set_info['Project_Name']) & same_day].copy()
             
             st.divider()
             
             # A. FLOW RATE CONTROL
             with st.expander("💧 1. Flow Rate (Timer & Falcon)", expanded=True):
-                col_t1, col_t2, col_t3 = st.columns([1,1,2])
-                
-                current_timer = 0.0
+                # Minuti: timer in corso, altrimenti ultimo STOP su questo set, altrimenti quanto salvato
+                current_timer = pd.to_numeric(current_df['Durata_Min'], errors='coerce').fillna(0).max()
+                last = st.session_state.get('timer_last')
                 if 'timer_start' in st.session_state:
-                    delta = datetime.now() - st.session_state.timer_start
-                    current_timer = delta.total_seconds() / 60
-                    col_t3.warning(f"⏱️ IN CORSO: {current_timer:.2f} min")
-                    if col_t2.button("⏹️ STOP TIMER"):
-                        current_df['Durata_Min'] = current_timer
-                        clear_session_state(st.session_state.username, sh)
-                        del st.session_state['timer_start']
-                        st.rerun()
-                else:
-                    saved_time = pd.to_numeric(current_df['Durata_Min'], errors='coerce').fillna(0).max()
-                    if saved_time > 0: current_timer = saved_time
-                    col_t3.info(f"Ultimo Tempo: {current_timer:.2f} min")
-                    if col_t1.button("▶️ START TIMER"):
-                        now = datetime.now()
-                        st.session_state.timer_start = now
-                        save_session_state(st.session_state.username, now.strftime("%Y-%m-%d %H:%M:%S"), current_set_info['Project_Name'], sh)
-                        st.rerun()
+                    current_timer = (datetime.now() - st.session_state.timer_start).total_seconds() / 60
+                elif last and last[0] == selected_label: current_timer = last[1]
+                running = 'timer_start' in st.session_state
+                st.fragment(timer_panel, run_every=1 if running else None)(selected_label, current_set_info['Project_Name'], current_timer)
 
                 c_fal1, c_fal2 = st.columns(2)
                 with c_fal1: 
@@ -312,7 +358,7 @@ if menu == "1. Gestione Esperimenti (Flow/SMR)":
                 for c in cols_bio:
                     if c not in current_df.columns: current_df[c] = ""
                 
-                df_bio_edit = current_df[cols_bio].copy()
+                df_bio_edit = current_df[cols_bio].astype({'Sex': str})  # valori liberi nell'editor, non solo le category
                 edited_bio = st.data_editor(
                     df_bio_edit,
                     hide_index=True,
@@ -330,78 +376,60 @@ if menu == "1. Gestione Esperimenti (Flow/SMR)":
             col_act1, col_act2 = st.columns(2)
             
             if col_act1.button("💾 AGGIORNA DATI (Salva & Esci)", type="primary"):
-                progress = st.progress(0)
+                perf.start("save")
                 tot_rows = len(current_df)
+                updates = {}
                 
+                # Flow rate, delta e watts calcolati su colonne intere
+                first = current_df.iloc[0]
+                fr_all, delta_all, watts_all = flow_watts(
+                    edited_falcon['Peso_Pieno'], edited_falcon['Tara'], edited_falcon['Minuti'],
+                    edited_bio['SMR_1'], edited_bio['SMR_2'], first['Temperatura'], first['Pressione'])
+
                 for i in range(tot_rows):
                     row_f = edited_falcon.iloc[i]
                     row_b = edited_bio.iloc[i]
                     uid = str(row_f['ID_Univoco'])
-                    
-                    fr = 0.0
-                    try:
-                        p_pieno = float(row_f['Peso_Pieno']) if row_f['Peso_Pieno'] else 0.0
-                        tara = float(row_f['Tara'])
-                        mins = float(row_f['Minuti'])
-                        if mins > 0 and p_pieno > tara: fr = (p_pieno - tara) / mins
-                    except: pass
-                    
-                    watts = 0.0
-                    try:
-                        temp = float(current_df.iloc[0]['Temperatura']) if current_df.iloc[0]['Temperatura'] else 20.0
-                        press = float(current_df.iloc[0]['Pressione']) if current_df.iloc[0]['Pressione'] else 1013.0
-                        smr1 = float(row_b['SMR_1']) if row_b['SMR_1'] else 0.0
-                        smr2 = float(row_b['SMR_2']) if row_b['SMR_2'] else 0.0
-                        delta = abs(smr1 - smr2)
-                        if fr > 0: watts = (delta * fr * press) / (temp + 273.15)
-                    except: pass
-
-                    try:
-                        cell = ws_db.find(uid)
-                        r = cell.row
-                        # Update mappato su colonne fisse per sicurezza
-                        ws_db.update_cell(r, 12, set_falcon)
-                        ws_db.update_cell(r, 13, str(row_f['Falcon_ID']))
-                        ws_db.update_cell(r, 14, clean_for_json(row_f['Tara']))
-                        ws_db.update_cell(r, 15, clean_for_json(row_f['Peso_Pieno']))
-                        ws_db.update_cell(r, 16, clean_for_json(row_f['Minuti']))
-                        ws_db.update_cell(r, 17, clean_for_json(fr))
-                        
-                        ws_db.update_cell(r, 18, clean_for_json(row_b['SMR_1']))
-                        ws_db.update_cell(r, 19, clean_for_json(row_b['SMR_2']))
-                        ws_db.update_cell(r, 20, clean_for_json(abs(clean_for_json(row_b['SMR_1']) - clean_for_json(row_b['SMR_2']))))
-                        ws_db.update_cell(r, 21, clean_for_json(watts))
-                        ws_db.update_cell(r, 22, str(row_b['Sex']))
-                        ws_db.update_cell(r, 23, clean_for_json(row_b['Body_Length']))
-                        ws_db.update_cell(r, 24, clean_for_json(row_b['Head_Length']))
-                        ws_db.update_cell(r, 25, str(row_b['Note']))
-                        ws_db.update_cell(r, 27, "IN_CORSO")
-                    except: pass
-
-                    progress.progress((i+1)/tot_rows)
-                
-                st.success("Salvato!")
-                time.sleep(1)
+                    updates[uid] = {
+                        "Falcon_Set": set_falcon,
+                        "Falcon_ID": str(row_f['Falcon_ID']),
+                        "Peso_Vuoto": clean_for_json(row_f['Tara']),
+                        "Peso_Pieno": clean_for_json(row_f['Peso_Pieno']),
+                        "Durata_Min": clean_for_json(row_f['Minuti']),
+                        "Flow_Rate": clean_for_json(fr_all[i]),
+                        "SMR_1": clean_for_json(row_b['SMR_1']),
+                        "SMR_2": clean_for_json(row_b['SMR_2']),
+                        "Delta_Torr": clean_for_json(delta_all[i]),
+                        "Watts": clean_for_json(watts_all[i]),
+                        "Sex": str(row_b['Sex']),
+                        "Body_Length": clean_for_json(row_b['Body_Length']),
+                        "Head_Length": clean_for_json(row_b['Head_Length']),
+                        "Note": str(row_b['Note']),
+                        "Stato": "IN_CORSO",
+                    }
+
+                # Nel journal locale: l'invio al foglio lo fa il worker in background
+                saved = store.update_fields(updates, user=st.session_state.username)
+                st.session_state.pop('timer_last', None)
+                st.session_state.flash = f"Salvato! ({saved} righe)"
                 st.rerun()
 
             if col_act2.button("✅ ARCHIVIA (Fine Esperimento)"):
+                perf.start("archive")
+                updates = {}
                 for i, row in current_df.iterrows():
-                    try:
-                        cell = ws_db.find(str(row['ID_Univoco']))
-                        ws_db.update_cell(cell.row, 27, "ARCHIVIATO")
-                    except: pass
-                st.success("Archiviato!")
+                    updates[str(row['ID_Univoco'])] = {"Stato": "ARCHIVIATO"}
+                store.update_fields(updates, user=st.session_state.username)
+                st.session_state.flash = "Archiviato!"
                 st.rerun()
 
 # =============================================================================
 # SEZIONE 2: PESI (DAY 3)
 # =============================================================================
 elif menu == "2. Pesi (Day 3)":
+    perf.start("pesi")
     st.header("Inserimento Dry Weight")
-    ws_db = sh.worksheet("DB_Respirometria")
-    all_data = ws_db.get_all_records()
-    if not all_data: df = pd.DataFrame(columns=EXPECTED_HEADERS)
-    else: df = pd.DataFrame(all_data)
+    df = store.list_records()
     
     if not df.empty and 'Dry_Weight' in df.columns:
         to_update = df[ pd.to_numeric(df['Dry_Weight'], errors='coerce').isna() ].copy()
@@ -418,22 +446,18 @@ elif menu == "2. Pesi (Day 3)":
                 to_update[["ID_Univoco", "ID_Animale", "Data", "Dry_Weight"]],
                 hide_index=True,
                 disabled=["ID_Univoco", "ID_Animale", "Data"],
-                column_config={"Dry_Weight": st.column_config.NumberColumn(required=True)}
+                column_config={"Dry_Weight": st.column_config.NumberColumn(required=True),
+                               "Data": st.column_config.DateColumn(format="YYYY-MM-DD")}
             )
             
             if st.button("💾 Salva Pesi"):
-                prog = st.progress(0)
-                cnt = 0
-                for i, row in edited_dw.iterrows():
-                    if row['Dry_Weight'] != "" and row['Dry_Weight'] is not None:
-                        try:
-                            cell = ws_db.find(str(row['ID_Univoco']))
-                            ws_db.update_cell(cell.row, 26, float(row['Dry_Weight']))
-                            cnt += 1
-                        except: pass
-                    prog.progress((i+1)/len(edited_dw))
-                st.success(f"Fatto ({cnt} pesi).")
-                time.sleep(1)
+                perf.start("save_pesi")
+                updates = {}
+                dw = pd.to_numeric(edited_dw['Dry_Weight'], errors='coerce').to_numpy()  # scalari numpy: niente cifre spurie dal float32
+                for uid, w in zip(edited_dw['ID_Univoco'], dw):
+                    if pd.notna(w): updates[str(uid)] = {"Dry_Weight": clean_for_json(w)}
+                cnt = store.update_fields(updates, user=st.session_state.username)
+                st.session_state.flash = f"Fatto ({cnt} pesi)."
                 st.rerun()
     else:
         st.info("Nessun dato o colonne mancanti.")
@@ -442,18 +466,51 @@ elif menu == "2. Pesi (Day 3)":
 # SEZIONE 3: EXPORT
 # =============================================================================
 elif menu == "3. Export":
-    if st.button("🔄 Ricarica"): st.rerun()
-    ws_db = sh.worksheet("DB_Respirometria")
-    df = pd.DataFrame(ws_db.get_all_records())
-    
-    if not df.empty and 'Custom_Tags_JSON' in df.columns:
-        st.write("Anteprima:")
-        tags_list = []
-        for x in df['Custom_Tags_JSON']:
-            try: tags_list.append(json.loads(x))
-            except: tags_list.append({})
-        tags_df = pd.json_normalize(tags_list)
-        df_final = pd.concat([df.drop('Custom_Tags_JSON', axis=1), tags_df], axis=1)
-        st.dataframe(df_final)
+    perf.start("export")
+    if st.button("🔄 Ricarica"):
+        store.invalidate()
+        st.rerun()
+    df = store.list_records(include_archive=True)
+    vista = st.radio("Vista", ["Dati", "Riepilogo per gruppi"], horizontal=True)
+
+    if vista == "Riepilogo per gruppi":
+        # Solo la tabella aggregata va al browser, non le righe del DB
+        tag_opts = [t for t in store.unique_tags() if t not in df.columns]
+        by = st.multiselect("Raggruppa per", ["Project_Name", "Data"] + tag_opts, default=["Project_Name"])
+        if df.empty or not by: st.info("Nessun dato o nessun raggruppamento scelto.")
+        else:
+            summary = summary_view(len(df), store.data_version(), tuple(by), df)
+            st.caption(f"{len(summary)} gruppi da {len(df)} righe (set in SETUP esclusi). Watts_per_g = Watts / Dry_Weight.")
+            st.dataframe(summary, hide_index=True, column_config={"Data": st.column_config.DateColumn(format="YYYY-MM-DD")})
+            st.download_button("⬇️ Riepilogo CSV", data=summary.to_csv(index=False), file_name=f"riepilogo_{datetime.now():%Y%m%d_%H%M}.csv",
+                               mime="text/csv", on_click="ignore")
+    elif not df.empty and 'Custom_Tags_JSON' in df.columns:
+        # Download generati solo al click, a blocchi; anteprima limitata a una pagina
+        stamp = datetime.now().strftime("%Y%m%d_%H%M")
+        c_csv, c_pq, c_page = st.columns([1, 1, 2])
+        c_csv.download_button("⬇️ CSV", data=lambda: export_csv(df), file_name=f"respirometria_{stamp}.csv",
+                              mime="text/csv", on_click="ignore")
+        if parquet_available():
+            c_pq.download_button("⬇️ Parquet", data=lambda: export_parquet(df), file_name=f"respirometria_{stamp}.parquet",
+                                 mime="application/octet-stream", on_click="ignore")
+        n_pages = (len(df) - 1) // PREVIEW_ROWS + 1
+        page = c_page.number_input(f"Pagina (di {n_pages})", 1, n_pages, 1) - 1
+        st.write(f"Anteprima: righe {page * PREVIEW_ROWS + 1}-{min((page + 1) * PREVIEW_ROWS, len(df))} di {len(df)}")
+        st.dataframe(preview_page(df, page))
     else:
-        st.dataframe(df)
+        st.dataframe(df.head(PREVIEW_ROWS))
+
+# =============================================================================
+# PANNELLO PRESTAZIONI (solo admin)
+# =============================================================================
+prev_stats = st.session_state.get("perf_last")
+stats = perf.end_rerun(st.session_state)
+if st.session_state.username in ADMIN_USERS and stats is not None:
+    with st.sidebar.expander("⏱️ Prestazioni"):
+        st.caption(f"Questo rerun: {stats.total * 1000:.0f} ms" +
+                   (f" · precedente: {prev_stats.total * 1000:.0f} ms" if prev_stats is not None and prev_stats.total else ""))
+        st.dataframe(pd.DataFrame(perf.summary_rows(stats)), hide_index=True)
+        bg = store.last_stats
+        if bg is not None:
+            st.caption(f"Ultimo invio in background: {bg.total * 1000:.0f} ms")
+            st.dataframe(pd.DataFrame(perf.summary_rows(bg)), hide_index=True)
@@ -0,0 +1,32 @@
+import hashlib
+import hmac
+import os
+import sys
+
+# --- PASSWORD ---
+# Nel foglio Users la colonna Password contiene "pbkdf2_sha256$<iterazioni>$<salt hex>$<hash hex>".
+# Le password ancora in chiaro vengono accettate (confronto a tempo costante) finché non si rigenerano con:
+#   python auth.py <password>
+SCHEME = "pbkdf2_sha256"
+ITERATIONS = 200_000
+
+def hash_password(password, salt=None, iterations=ITERATIONS):
+    salt = salt or os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", str(password).encode(), salt, iterations)
+    return f"{SCHEME}${iterations}${salt.hex()}${dk.hex()}"
+
+# Hash fittizio per gli utenti inesistenti: stesso costo di una verifica vera
+_DUMMY = hash_password("", salt=b"\0" * 16)
+
+def verify_password(stored, password):
+    stored = str(stored if stored is not None else _DUMMY).strip()
+    parts = stored.split("$")
+    if len(parts) == 4 and parts[0] == SCHEME:
+        try: salt, iterations = bytes.fromhex(parts[2]), int(parts[1])
+        except ValueError: return False
+        return hmac.compare_digest(hash_password(password, salt, iterations), stored)
+    return hmac.compare_digest(stored.encode(), str(password).strip().encode())
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2: sys.exit("uso: python auth.py <password>")
+    print(hash_password(sys.argv[1]))
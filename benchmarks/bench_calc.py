@@ -0,0 +1,90 @@
+# Micro-benchmark: calcolo Flow_Rate / Watts riga per riga (vecchio ciclo di salvataggio)
+# contro calc.flow_watts vettoriale.
+#   python benchmarks/bench_calc.py [--sizes 100,10000,1000000] [--max-rowwise N]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from calc import flow_watts
+
+def make_frames(n, seed=0):
+    # Colonne "object" con qualche cella vuota, come arrivano da get_all_records / data_editor
+    rng = np.random.default_rng(seed)
+    def col(values, p_empty=0.05):
+        out = values.astype(object)
+        out[rng.random(n) < p_empty] = ""
+        return out
+    falcon = pd.DataFrame({
+        "Peso_Pieno": col(rng.uniform(9.0, 40.0, n)),
+        "Tara": rng.uniform(9.9, 10.1, n),
+        "Minuti": rng.uniform(0.0, 15.0, n),
+    })
+    bio = pd.DataFrame({"SMR_1": col(rng.uniform(100, 160, n)), "SMR_2": col(rng.uniform(60, 120, n))})
+    env = pd.DataFrame({"Temperatura": [20.0], "Pressione": [1013.0]})
+    return falcon, bio, env
+
+def rowwise(edited_falcon, edited_bio, current_df):
+    # Copia del vecchio ciclo in app.py (solo la parte di calcolo)
+    frs, watts_all = [], []
+    for i in range(len(edited_falcon)):
+        row_f = edited_falcon.iloc[i]
+        row_b = edited_bio.iloc[i]
+        fr = 0.0
+        try:
+            p_pieno = float(row_f['Peso_Pieno']) if row_f['Peso_Pieno'] else 0.0
+            tara = float(row_f['Tara'])
+            mins = float(row_f['Minuti'])
+            if mins > 0 and p_pieno > tara: fr = (p_pieno - tara) / mins
+        except: pass
+        watts = 0.0
+        try:
+            temp = float(current_df.iloc[0]['Temperatura']) if current_df.iloc[0]['Temperatura'] else 20.0
+            press = float(current_df.iloc[0]['Pressione']) if current_df.iloc[0]['Pressione'] else 1013.0
+            smr1 = float(row_b['SMR_1']) if row_b['SMR_1'] else 0.0
+            smr2 = float(row_b['SMR_2']) if row_b['SMR_2'] else 0.0
+            delta = abs(smr1 - smr2)
+            if fr > 0: watts = (delta * fr * press) / (temp + 273.15)
+        except: pass
+        frs.append(fr)
+        watts_all.append(watts)
+    return np.array(frs), np.array(watts_all)
+
+def vectorized(edited_falcon, edited_bio, current_df):
+    first = current_df.iloc[0]
+    fr, _, watts = flow_watts(edited_falcon['Peso_Pieno'], edited_falcon['Tara'], edited_falcon['Minuti'],
+                              edited_bio['SMR_1'], edited_bio['SMR_2'], first['Temperatura'], first['Pressione'])
+    return fr, watts
+
+def best_of(fn, args, repeat):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="100,10000,1000000")
+    ap.add_argument("--max-rowwise", type=int, default=None, help="salta il percorso riga per riga oltre N righe")
+    args = ap.parse_args()
+
+    print(f"{'righe':>10} {'riga/riga (s)':>14} {'vettoriale (s)':>15} {'speedup':>9}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        frames = make_frames(n)
+        repeat = 5 if n <= 10_000 else 1
+        t_vec, (fr_v, w_v) = best_of(vectorized, frames, repeat)
+        if args.max_rowwise is not None and n > args.max_rowwise:
+            print(f"{n:>10} {'-':>14} {t_vec:>15.4f} {'-':>9}")
+            continue
+        t_row, (fr_r, w_r) = best_of(rowwise, frames, repeat)
+        assert np.allclose(fr_r, fr_v) and np.allclose(w_r, w_v), "risultati diversi"
+        print(f"{n:>10} {t_row:>14.4f} {t_vec:>15.4f} {t_row / t_vec:>8.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Benchmark offline dei flussi principali dell'app contro un finto gspread con latenza simulata.
+#   python benchmarks/bench_flows.py [--sizes 1000,10000,100000] [--latency 0.05] [--quota 300] [--legacy]
+# Per ogni dimensione del DB riporta tempo e numero di chiamate API di:
+# login, apertura set, salvataggio di 30 animali, archiviazione, pesi secchi, export.
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fake_gspread import FakeAPI, seed
+from storage import EXPECTED_HEADERS, SheetsStorage
+from scheduler import Scheduler, ScheduledSpreadsheet
+from calc import flow_watts
+from export import export_csv
+
+USER = "bench"
+
+def _save_updates(current):
+    fr, delta, watts = flow_watts(current['Peso_Pieno'], current['Peso_Vuoto'], current['Durata_Min'],
+                                  current['SMR_1'], current['SMR_2'], 20.0, 1013.0)
+    return {str(uid): {"Flow_Rate": float(fr[i]), "Delta_Torr": float(delta[i]), "Watts": float(watts[i]),
+                       "Note": "bench", "Stato": "IN_CORSO"}
+            for i, uid in enumerate(current['ID_Univoco'])}
+
+def legacy_save(sh, uids):
+    # Vecchio percorso: find + un update_cell per colonna, errori ignorati come nell'app originale
+    ws = sh.worksheet("DB_Respirometria")
+    dropped = 0
+    for uid in uids:
+        try:
+            cell = ws.find(uid)
+            for col in range(12, 28):
+                if col != 26: ws.update_cell(cell.row, col, "x" if col == 25 else 0)
+        except Exception: dropped += 1
+    return dropped
+
+def run(n, args):
+    api = FakeAPI(latency=args.latency, per_cell_us=args.per_cell_us, per_minute=args.quota)
+    sh = seed(api, EXPECTED_HEADERS, n, user=USER, partitioned=not args.legacy_layout)
+    api.calls.clear()
+    sched = Scheduler(per_minute=args.quota or 10 ** 9, burst=args.burst, base_delay=0.5)
+    store = SheetsStorage(ScheduledSpreadsheet(sh, sched), ttl=60)
+    results, state = [], {}
+
+    def flow(name, fn, counter=api):
+        sched.begin_rerun()
+        before = counter.calls.copy()
+        t0 = time.perf_counter()
+        try: note = fn()
+        except Exception as e: note = f"ERRORE: {e}"
+        results.append((name, time.perf_counter() - t0, sum((counter.calls - before).values()), note or ""))
+
+    def login():
+        # Come l'app: utente, poi le letture del primo render in parallelo
+        store.get_user(USER)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            jobs = [pool.submit(store.unique_tags), pool.submit(store.project_names), pool.submit(store.load_session, USER),
+                    pool.submit(store.list_records, operatore=USER, exclude_stato="ARCHIVIATO")]
+            for j in jobs: j.result()
+
+    def open_set():
+        my_open = store.list_records(operatore=USER, exclude_stato="ARCHIVIATO")
+        store.project_names()
+        first = my_open.iloc[0]
+        state["current"] = my_open[(my_open['Project_Name'] == first['Project_Name']) & (my_open['Data'] == first['Data'])]
+        return f"{len(state['current'])} animali"
+
+    def save():
+        return f"{store.update_fields(_save_updates(state['current']))} righe"
+
+    def archive():
+        store.update_fields({str(u): {"Stato": "ARCHIVIATO"} for u in state["current"]['ID_Univoco']})
+        return f"{store.archive_finished()} spostate"
+
+    def dry_weight():
+        df = store.list_records()
+        todo = df[pd.to_numeric(df['Dry_Weight'], errors='coerce').isna()].head(30)
+        store.update_fields({str(u): {"Dry_Weight": 1.0} for u in todo['ID_Univoco']})
+        return f"{len(todo)} pesi, {store.archive_finished()} spostate"
+
+    def export():
+        df = store.list_records(include_archive=True)
+        size = len(export_csv(df))
+        return f"{len(df)} righe, {size / 1e6:.1f} MB"
+
+    flow("login", login)
+    flow("apri set", open_set)
+    flow("salva 30 animali", save)
+    if args.legacy:
+        # Su una copia separata dello stesso DB, con la propria quota
+        legacy_api = FakeAPI(latency=args.latency, per_cell_us=args.per_cell_us, per_minute=args.quota)
+        legacy_sh = seed(legacy_api, EXPECTED_HEADERS, n, user=USER, partitioned=not args.legacy_layout)
+        uids = [str(u) for u in state["current"]['ID_Univoco']]
+        flow("salva 30 (vecchio)", lambda: f"{legacy_save(legacy_sh, uids)} righe perse", legacy_api)
+    flow("archivia", archive)
+    flow("pesi secchi", dry_weight)
+    flow("export", export)
+    return results, api
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000,100000")
+    ap.add_argument("--latency", type=float, default=0.05, help="secondi per chiamata API")
+    ap.add_argument("--per-cell-us", type=float, default=0.2, help="microsecondi per cella letta")
+    ap.add_argument("--quota", type=int, default=None, help="chiamate al minuto prima del 429")
+    ap.add_argument("--burst", type=int, default=15)
+    ap.add_argument("--legacy", action="store_true", help="aggiunge il vecchio salvataggio cella per cella")
+    ap.add_argument("--legacy-layout", action="store_true", help="tutte le righe nel foglio di lavoro, senza partizioni")
+    args = ap.parse_args()
+
+    print(f"{'righe DB':>9}  {'flusso':<20} {'tempo (s)':>9} {'chiamate':>8}  note")
+    for n in (int(x) for x in args.sizes.split(",")):
+        results, api = run(n, args)
+        for name, secs, calls, note in results:
+            print(f"{n:>9}  {name:<20} {secs:>9.2f} {calls:>8}  {note}")
+        print(f"{n:>9}  {'totale':<20} {sum(r[1] for r in results):>9.2f} {sum(r[2] for r in results):>8}  "
+              f"429: {sum(api.errors.values())}")
+
+if __name__ == "__main__":
+    main()
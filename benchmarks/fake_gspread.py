@@ -0,0 +1,218 @@
+# Finto gspread in memoria per i benchmark offline: stessa superficie di Spreadsheet/Worksheet
+# usata dall'app, con latenza per chiamata e quota al minuto configurabili e conteggio delle chiamate.
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol, numericise_all, rowcol_to_a1
+
+class FakeResponse:
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self.text, "status": "RESOURCE_EXHAUSTED"}}
+
+class FakeAPI:
+    # latency: secondi fissi per chiamata; per_cell_us: costo di trasferimento per cella letta;
+    # per_minute: quota (finestra mobile di 60 s), oltre la quale si riceve un 429
+    def __init__(self, latency=0.05, per_cell_us=0.0, per_minute=None):
+        self.latency = latency
+        self.per_cell_us = per_cell_us
+        self.per_minute = per_minute
+        self.calls = Counter()
+        self.errors = Counter()
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    def hit(self, method, cells=0):
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] > 60: self._window.popleft()
+            if self.per_minute is not None and len(self._window) >= self.per_minute:
+                self.errors[method] += 1
+                raise APIError(FakeResponse(429, "Quota exceeded (fake)"))
+            self._window.append(now)
+            self.calls[method] += 1
+        time.sleep(self.latency + cells * self.per_cell_us / 1e6)
+
+    def total(self):
+        return sum(self.calls.values())
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+def _cell(v):
+    # Come il foglio reale: si rilegge sempre testo
+    return "" if v is None else str(v)
+
+class FakeWorksheet:
+    def __init__(self, api, title, sheet_id, rows=None):
+        self.api = api
+        self.title = title
+        self.id = sheet_id
+        self.rows = [[_cell(v) for v in r] for r in (rows or [])]
+
+    # --- letture ---
+    def _used(self):
+        n = len(self.rows)
+        while n and not any(self.rows[n - 1]): n -= 1
+        return n
+
+    def get_all_values(self, **kwargs):
+        vals = [list(r) for r in self.rows[:self._used()]]
+        self.api.hit("get_all_values", sum(len(r) for r in vals))
+        return vals
+
+    def get_all_records(self, head=1, **kwargs):
+        vals = [list(r) for r in self.rows[:self._used()]]
+        self.api.hit("get_all_records", sum(len(r) for r in vals))
+        if len(vals) < head: return []
+        keys = vals[head - 1]
+        out = []
+        for r in vals[head:]:
+            r = numericise_all(r + [""] * (len(keys) - len(r)))
+            out.append(dict(zip(keys, r)))
+        return out
+
+    def col_values(self, col, **kwargs):
+        vals = [r[col - 1] if len(r) >= col else "" for r in self.rows]
+        while vals and vals[-1] == "": vals.pop()
+        self.api.hit("col_values", len(vals))
+        return vals
+
+    def row_values(self, row, **kwargs):
+        self.api.hit("row_values", 1)
+        vals = list(self.rows[row - 1]) if row <= len(self.rows) else []
+        while vals and vals[-1] == "": vals.pop()
+        return vals
+
+    def find(self, query, **kwargs):
+        self.api.hit("find", len(self.rows))
+        for i, r in enumerate(self.rows):
+            for j, v in enumerate(r):
+                if v == str(query): return FakeCell(i + 1, j + 1, v)
+        return None
+
+    # --- scritture ---
+    def _set(self, row, col, value):
+        while len(self.rows) < row: self.rows.append([])
+        r = self.rows[row - 1]
+        while len(r) < col: r.append("")
+        r[col - 1] = _cell(value)
+
+    def update_cell(self, row, col, value):
+        self.api.hit("update_cell")
+        self._set(row, col, value)
+
+    def _write_range(self, a1, values):
+        start = a1.split("!")[-1].split(":")[0]
+        r0, c0 = a1_to_rowcol(start)
+        for i, row in enumerate(values):
+            for j, v in enumerate(row): self._set(r0 + i, c0 + j, v)
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self.api.hit("update")
+        self._write_range(range_name or "A1", values)
+
+    def batch_update(self, data, **kwargs):
+        self.api.hit("batch_update")
+        for d in data: self._write_range(d["range"], d["values"])
+
+    def append_rows(self, values, **kwargs):
+        self.api.hit("append_rows")
+        start = self._used() + 1
+        del self.rows[start - 1:]
+        for v in values: self.rows.append([_cell(x) for x in v])
+        end = start + len(values) - 1
+        width = max((len(v) for v in values), default=1)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:{rowcol_to_a1(end, width)}"}}
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values])
+
+    def delete_rows(self, start_index, end_index=None):
+        self.api.hit("delete_rows")
+        del self.rows[start_index - 1:(end_index or start_index)]
+
+class FakeSpreadsheet:
+    def __init__(self, api):
+        self.api = api
+        self.id = "fake-spreadsheet"
+        self._sheets = {}
+
+    def _new(self, title, rows=None):
+        ws = FakeWorksheet(self.api, title, len(self._sheets) + 1, rows)
+        self._sheets[title] = ws
+        return ws
+
+    def worksheet(self, title):
+        self.api.hit("worksheet")
+        if title not in self._sheets: raise WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def worksheets(self, **kwargs):
+        self.api.hit("worksheets")
+        return list(self._sheets.values())
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self.api.hit("add_worksheet")
+        return self._new(title)
+
+    def batch_update(self, body):
+        # Solo le richieste usate dall'app: deleteDimension sulle righe, applicate in ordine
+        self.api.hit("batch_update")
+        by_id = {ws.id: ws for ws in self._sheets.values()}
+        for req in body["requests"]:
+            rng = req["deleteDimension"]["range"]
+            del by_id[rng["sheetId"]].rows[rng["startIndex"]:rng["endIndex"]]
+        return {"replies": [{} for _ in body["requests"]]}
+
+# --- DATI SINTETICI ---
+def synthetic_row(headers, rng, project, data, operatore, stato, idx, dry=True):
+    smr1, smr2 = rng.uniform(100, 160), rng.uniform(60, 120)
+    vals = {
+        "ID_Univoco": str(uuid.UUID(int=rng.getrandbits(128))), "Project_Name": project, "Data": data,
+        "Operatore": operatore, "Temperatura": 20, "Pressione": 1013,
+        "Custom_Tags_JSON": '{"Vasca": "%d", "Dieta": "%s"}' % (idx % 4, "A" if idx % 2 else "B"),
+        "ID_Animale": f"Ind_{idx + 1}", "Siringa": idx + 1, "Falcon_Set": "Set Normal",
+        "Falcon_ID": f"F_{idx + 1}", "Peso_Vuoto": 9.95, "Peso_Pieno": round(rng.uniform(20, 40), 3),
+        "Durata_Min": 10, "Flow_Rate": 1.5, "SMR_1": round(smr1, 2), "SMR_2": round(smr2, 2),
+        "Delta_Torr": round(abs(smr1 - smr2), 2), "Watts": 0.5, "Sex": rng.choice(["M", "F"]),
+        "Body_Length": 50, "Head_Length": 10, "Note": "",
+        "Dry_Weight": round(rng.uniform(0.1, 2), 3) if dry else "", "Stato": stato,
+    }
+    return [vals.get(h, "") for h in headers]
+
+def seed(api, headers, n_rows, user="bench", set_size=30, partitioned=True, seed=0):
+    # DB con n_rows righe in set da set_size animali. L'ultimo set dell'utente di benchmark è IN_CORSO,
+    # circa il 5% è archiviato in attesa del peso secco, il resto è concluso (nelle partizioni
+    # DB_Archive_<anno> se partitioned, altrimenti tutto nel foglio di lavoro come nel vecchio layout).
+    rng = random.Random(seed)
+    sh = FakeSpreadsheet(api)
+    live, archive = [list(headers)], {}
+    n_sets = max(1, n_rows // set_size)
+    projects = [f"Progetto_{i}" for i in range(max(1, n_sets // 20))]
+    operators = [f"op_{i}" for i in range(10)]
+    for s in range(n_sets):
+        year = 2020 + s * 6 // n_sets
+        data = f"{year}-{(s % 12) + 1:02d}-{(s % 28) + 1:02d}"
+        last = s == n_sets - 1
+        if last: stato, op, dry = "IN_CORSO", user, False
+        elif s >= n_sets * 0.95: stato, op, dry = "ARCHIVIATO", rng.choice(operators), False
+        else: stato, op, dry = "ARCHIVIATO", rng.choice(operators), True
+        project = rng.choice(projects)
+        rows = [synthetic_row(headers, rng, project, data, op, stato, i, dry) for i in range(set_size)]
+        if dry and partitioned: archive.setdefault(str(year), []).extend(rows)
+        else: live.extend(rows)
+    sh._new("DB_Respirometria", live)
+    for year, rows in sorted(archive.items()): sh._new(f"DB_Archive_{year}", [list(headers)] + rows)
+    sh._new("Users", [["Username", "Password", "Nome_Completo"], [user, "bench", "Utente Benchmark"]])
+    sh._new("Active_Sessions", [["Username", "Start_Time", "Project"]])
+    sh._new("Catalog", [["Tipo", "Valore"]] + [["project", p] for p in projects] + [["tag", "Vasca"], ["tag", "Dieta"]])
+    return sh
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# --- CALCOLI FLOW RATE / WATTS ---
+# Stesse formule del vecchio ciclo di salvataggio, ma su colonne intere:
+#   Flow_Rate  = (Peso_Pieno - Tara) / Minuti   (0 se Minuti <= 0 o Peso_Pieno <= Tara)
+#   Delta_Torr = |SMR_1 - SMR_2|
+#   Watts      = Delta_Torr * Flow_Rate * Pressione / (Temperatura + 273.15)   (0 se Flow_Rate <= 0)
+# Valori mancanti o non numerici: pesi/SMR -> 0, Tara/Minuti -> nessun flow rate,
+# Temperatura/Pressione -> valori standard.
+DEFAULT_TEMP = 20.0
+DEFAULT_PRESS = 1013.0
+KELVIN = 273.15
+
+def to_num(values, fill=0.0):
+    # Scalare, lista o Series -> array float64 con i mancanti ("" / None / testo) sostituiti da fill
+    if values is None: values = np.nan
+    if np.ndim(values) == 0: values = [values]
+    out = pd.to_numeric(pd.Series(values, copy=False), errors="coerce").to_numpy(dtype="float64")
+    return np.where(np.isnan(out), fill, out)
+
+def flow_watts(peso_pieno, tara, minuti, smr1, smr2, temp=DEFAULT_TEMP, press=DEFAULT_PRESS):
+    # Restituisce tre array (flow_rate, delta_torr, watts); temp e press possono essere scalari o colonne
+    pp = to_num(peso_pieno)
+    ta = to_num(tara, np.nan)
+    mi = to_num(minuti, np.nan)
+    ok = (mi > 0) & (pp > ta)  # i confronti con NaN sono False
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fr = np.where(ok, (pp - ta) / mi, 0.0)
+    delta = np.abs(to_num(smr1) - to_num(smr2))
+    t = to_num(temp, DEFAULT_TEMP)
+    p = to_num(press, DEFAULT_PRESS)
+    watts = np.where(fr > 0, delta * fr * p / (t + KELVIN), 0.0)
+    return fr, delta, watts
+
+def derive_columns(df):
+    # Ricalcola Flow_Rate, Delta_Torr e Watts per un intero progetto (colonne del DB)
+    out = df.copy()
+    fr, delta, watts = flow_watts(df['Peso_Pieno'], df['Peso_Vuoto'], df['Durata_Min'],
+                                  df['SMR_1'], df['SMR_2'], df['Temperatura'], df['Pressione'])
+    out['Flow_Rate'], out['Delta_Torr'], out['Watts'] = fr, delta, watts
+    return out
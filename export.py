@@ -0,0 +1,118 @@
+import io
+import json
+from functools import lru_cache
+
+import pandas as pd
+
+# --- TAG PERSONALIZZATI ---
+TAGS_COL = "Custom_Tags_JSON"
+CHUNK_ROWS = 5000      # righe per blocco nell'export (tag espansi un blocco alla volta)
+PREVIEW_ROWS = 200     # righe per pagina nell'anteprima
+
+@lru_cache(maxsize=4096)
+def parse_tags(raw):
+    # Memoizzato sulla stringa JSON: gli animali di un set condividono lo stesso blob.
+    # Il dict restituito è condiviso, non va modificato.
+    try:
+        js = json.loads(raw)
+        return js if isinstance(js, dict) else {}
+    except: return {}
+
+def tag_table(raw_series):
+    # Una riga per ogni blob JSON distinto, indicizzata dalla stringa originale
+    uniques = pd.unique(raw_series.astype(str))
+    table = pd.json_normalize([parse_tags(r) for r in uniques])
+    table.index = uniques
+    return table
+
+def flatten(df, table=None):
+    # Sostituisce la colonna JSON con una colonna per tag (nessun json.loads riga per riga)
+    raw = df[TAGS_COL].astype(str)
+    if table is None: table = tag_table(raw)
+    tags = table.reindex(raw.to_numpy())
+    tags.index = df.index
+    # Un tag con lo stesso nome di una colonna del DB non deve sovrascriverla
+    tags.columns = [f"tag_{c}" if c in df.columns else c for c in tags.columns]
+    return pd.concat([df.drop(TAGS_COL, axis=1), tags], axis=1)
+
+def iter_flat_chunks(df, chunk_rows=CHUNK_ROWS):
+    # Il join completo non viene mai costruito: un blocco di righe alla volta
+    table = tag_table(df[TAGS_COL])
+    for start in range(0, len(df), chunk_rows):
+        yield flatten(df.iloc[start:start + chunk_rows], table)
+
+def preview_page(df, page, rows=PREVIEW_ROWS):
+    return flatten(df.iloc[page * rows:(page + 1) * rows])
+
+# --- RIEPILOGO PER GRUPPI ---
+SUMMARY_MEASURES = ["SMR_1", "SMR_2", "Delta_Torr", "Flow_Rate", "Watts"]
+WATTS_PER_G = "Watts_per_g"  # Watts / Dry_Weight
+
+def summarize(df, by):
+    # Conteggio, media e DS delle misure per gruppo. by: colonne del DB e/o nomi di tag.
+    # I set ancora in SETUP hanno misure segnaposto a 0 e non entrano nel riepilogo.
+    df = df[df['Stato'] != 'SETUP']
+    tag_keys = [c for c in by if c not in df.columns]
+    frame = df[[c for c in by if c in df.columns]].copy()
+    if tag_keys:
+        raw = df[TAGS_COL].astype(str)
+        tags = tag_table(raw).reindex(columns=tag_keys).reindex(raw.to_numpy())
+        for c in tag_keys: frame[c] = tags[c].fillna("").astype(str).to_numpy()
+    for c in SUMMARY_MEASURES: frame[c] = df[c].astype("float64")
+    dw = df['Dry_Weight'].astype("float64")
+    frame[WATTS_PER_G] = frame['Watts'] / dw.where(dw > 0)
+    measures = SUMMARY_MEASURES + [WATTS_PER_G]
+    g = frame.groupby(list(by), observed=True, dropna=False, sort=True)
+    out = g[measures].agg(["mean", "std"])
+    out.columns = [f"{c}_{'media' if stat == 'mean' else 'ds'}" for c, stat in out.columns]
+    out.insert(0, "N", g.size())
+    return out.round(4).reset_index()
+
+# --- EXPORT ---
+# A blocchi c'è solo l'espansione dei tag (il join completo non esiste mai in memoria). Il file invece
+# è tutto in memoria: download_button vuole bytes, quindi si scrive in un BytesIO e se ne restituisce il contenuto.
+def export_csv(df):
+    out = io.BytesIO()
+    for i, chunk in enumerate(iter_flat_chunks(df)):
+        out.write(chunk.to_csv(index=False, header=(i == 0)).encode("utf-8"))
+    return out.getvalue()
+
+def _parquet_schema(df, table):
+    # Tipi fissati su tutto il DB: misure -> float32 come in memoria, altre colonne numeriche
+    # (o di testo interamente numerico) -> float64, date -> timestamp, il resto (tag compresi) -> stringa
+    import pyarrow as pa
+    fields = []
+    for c in flatten(df.iloc[:0], table).columns:
+        kind = pa.string()
+        if c in df.columns:
+            col = df[c]
+            if pd.api.types.is_datetime64_any_dtype(col): kind = pa.timestamp("ms")
+            elif col.dtype == "float32": kind = pa.float32()
+            elif pd.api.types.is_numeric_dtype(col): kind = pa.float64()
+            else:
+                filled = col.astype(str).str.strip() != ""
+                if pd.to_numeric(col[filled], errors="coerce").notna().all(): kind = pa.float64()
+        fields.append(pa.field(str(c), kind))
+    return pa.schema(fields)
+
+def export_parquet(df):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = tag_table(df[TAGS_COL])
+    schema = _parquet_schema(df, table)
+    out = io.BytesIO()
+    with pq.ParquetWriter(out, schema) as writer:
+        for start in range(0, len(df), CHUNK_ROWS):
+            chunk = flatten(df.iloc[start:start + CHUNK_ROWS], table)
+            for f in schema:
+                if pa.types.is_timestamp(f.type): continue
+                if pa.types.is_floating(f.type): chunk[f.name] = pd.to_numeric(chunk[f.name], errors="coerce")
+                else: chunk[f.name] = [None if pd.isna(v) else str(v) for v in chunk[f.name]]
+            writer.write_table(pa.Table.from_pandas(chunk[schema.names], schema=schema, preserve_index=False))
+    return out.getvalue()
+
+def parquet_available():
+    try:
+        import pyarrow.parquet
+        return True
+    except ImportError: return False
@@ -0,0 +1,229 @@
+import json
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+import perf
+from scheduler import is_transient
+from storage import filter_records
+
+# --- SALVATAGGI IN DIFFERITA ---
+# I salvataggi dell'app finiscono prima in un journal SQLite locale (una riga per ID_Univoco + campo,
+# l'ultima modifica vince); un thread li invia allo storage a blocchi, con retry, e li cancella
+# solo dopo che la scrittura è andata a buon fine. Se la connessione cade a metà non si perde nulla.
+# Le modifiche che lo storage non può applicare (ID non trovato, valore rifiutato) passano nella
+# tabella dead: restano visibili all'operatore che le ha fatte, che può rimetterle in coda o scartarle.
+FLUSH_INTERVAL = 2.0   # secondi tra due giri del worker se nessuno lo sveglia
+FLUSH_BATCH = 500      # righe (ID_Univoco) per invio
+MAX_BACKOFF = 60.0
+NOT_FOUND = "ID non trovato nel foglio"
+
+def finishes(fields):
+    # Modifica che può concludere un set (archiviato + peso secco): solo dopo queste si lancia lo spostamento,
+    # che rilegge tutto il foglio di lavoro. Un normale salvataggio riscrive Stato = IN_CORSO e non conta.
+    return fields.get("Stato") == "ARCHIVIATO" or fields.get("Dry_Weight") not in (None, "")
+
+class Journal:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS pending (uid, field, value, user, ts, PRIMARY KEY (uid, field))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS dead (uid, field, value, user, ts, error, PRIMARY KEY (uid, field))")
+
+    def add(self, updates, user=""):
+        now = time.time()
+        rows = [(str(uid), f, json.dumps(v), user, now) for uid, fields in updates.items() for f, v in fields.items()]
+        with self.lock, self.conn:
+            # INSERT OR REPLACE assegna un nuovo rowid: una modifica arrivata durante un invio non viene cancellata
+            self.conn.executemany("INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?)", rows)
+        return len(updates)
+
+    def take(self, limit=FLUSH_BATCH, uid=None):
+        # -> ({uid: {campo: valore}}, {uid: [rowid da cancellare dopo l'invio]}, {uid: utente})
+        with self.lock:
+            uids = [uid] if uid is not None else \
+                [r[0] for r in self.conn.execute("SELECT DISTINCT uid FROM pending ORDER BY ts LIMIT ?", (limit,))]
+            if not uids: return {}, {}, {}
+            marks = ", ".join("?" * len(uids))
+            rows = self.conn.execute(f"SELECT rowid, uid, field, value, user FROM pending WHERE uid IN ({marks})", uids).fetchall()
+        batch, rowids, users = {}, {}, {}
+        for rowid, uid, field, value, user in rows:
+            batch.setdefault(uid, {})[field] = json.loads(value)
+            rowids.setdefault(uid, []).append(rowid)
+            users[uid] = user
+        return batch, rowids, users
+
+    def done(self, rowids):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM pending WHERE rowid = ?", [(r,) for r in rowids])
+
+    def bury(self, rowids, error):
+        # Dal journal alla tabella dead, con il motivo
+        with self.lock, self.conn:
+            for r in rowids:
+                self.conn.execute("INSERT OR REPLACE INTO dead SELECT uid, field, value, user, ts, ? FROM pending WHERE rowid = ?", (error, r))
+                self.conn.execute("DELETE FROM pending WHERE rowid = ?", (r,))
+
+    def dead(self, user=None):
+        sql, params = "SELECT uid, field, value, ts, error FROM dead", ()
+        if user is not None: sql, params = sql + " WHERE user = ?", (user,)
+        with self.lock: rows = self.conn.execute(sql + " ORDER BY ts", params).fetchall()
+        return [{"ID_Univoco": uid, "Campo": f, "Valore": str(json.loads(v)), "Ora": time.strftime("%d/%m %H:%M", time.localtime(ts)),
+                 "Errore": err} for uid, f, v, ts, err in rows]
+
+    def requeue(self, user):
+        # Una modifica più recente già in coda per lo stesso campo vince su quella recuperata
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO pending SELECT uid, field, value, user, ts FROM dead WHERE user = ?", (user,))
+            return self.conn.execute("DELETE FROM dead WHERE user = ?", (user,)).rowcount
+
+    def discard(self, user):
+        with self.lock, self.conn: return self.conn.execute("DELETE FROM dead WHERE user = ?", (user,)).rowcount
+
+    def snapshot(self):
+        with self.lock: rows = self.conn.execute("SELECT uid, field, value FROM pending").fetchall()
+        out = {}
+        for uid, field, value in rows: out.setdefault(uid, {})[field] = json.loads(value)
+        return out
+
+    def version(self):
+        with self.lock: return self.conn.total_changes
+
+    def count(self, user=None, table="pending"):
+        sql, params = f"SELECT COUNT(DISTINCT uid) FROM {table}", ()
+        if user is not None: sql, params = sql + " WHERE user = ?", (user,)
+        with self.lock: return self.conn.execute(sql, params).fetchone()[0]
+
+def overlay(df, pending):
+    # Valori ancora in coda sopra a quelli letti dallo storage, così l'operatore rivede subito ciò che ha salvato
+    if not pending or df.empty: return df
+    ids = df['ID_Univoco'].astype(str)
+    if not ids.isin(list(pending)).any(): return df
+    df = df.copy()
+    for col in {f for fields in pending.values() for f in fields} & set(df.columns):
+        new = {uid: fields[col] for uid, fields in pending.items() if col in fields}
+        rows = ids.isin(list(new))
+        if not rows.any(): continue
+        vals = ids[rows].map(new)
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.add_categories(sorted(set(vals.astype(str)) - set(df[col].cat.categories)))
+            vals = vals.astype(str)
+        elif pd.api.types.is_float_dtype(df[col]): vals = pd.to_numeric(vals, errors="coerce").astype(df[col].dtype)
+        df.loc[rows, col] = vals.to_numpy()
+    return df
+
+class WriteBehind:
+    # Si presenta come lo storage: update_fields mette in coda e ritorna subito, list_records include
+    # le modifiche in coda; lo spostamento in archivio lo lancia il worker dopo aver inviato modifiche
+    # che concludono un set (finishes). Il resto passa allo storage vero.
+    # Se un blocco viene rifiutato per un errore non di rete, i suoi ID si rimandano uno alla volta
+    # (prima di tutto il resto): quello che fallisce anche da solo va in dead, gli altri passano.
+    def __init__(self, store, journal, interval=FLUSH_INTERVAL):
+        self._store = store
+        self.journal = journal
+        self.interval = interval
+        self._wake = threading.Event()
+        self._status = {}         # utente -> {"last_flush", "last_error"}: ognuno vede solo i propri invii
+        self._suspect = []        # ID di un blocco rifiutato, da riprovare da soli
+        self._archive_due = set() # utenti i cui salvataggi chiedono lo spostamento in archivio
+        self.last_stats = None    # perf dell'ultimo giro che ha chiamato lo storage (pannello admin)
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self._store, name)
+
+    def list_records(self, operatore=None, project=None, exclude_stato=None, include_archive=False):
+        df = self._store.list_records(operatore=operatore, project=project, include_archive=include_archive)
+        df = overlay(df, self.journal.snapshot())
+        return filter_records(df, exclude_stato=exclude_stato) if exclude_stato is not None else df
+
+    def update_fields(self, updates, user=""):
+        n = self.journal.add(updates, user)
+        self._wake.set()
+        return n
+
+    def archive_finished(self, user=""):
+        # Lo spostamento avviene nel worker, dopo che Stato / Dry_Weight sono arrivati allo storage
+        self._archive_due.add(user)
+        self._wake.set()
+        return 0
+
+    def data_version(self):
+        return (self._store.data_version(), self.journal.version())
+
+    def status(self, user=None):
+        s = self._status.get(user, {})
+        return {"pending": self.journal.count(user), "dead": self.journal.count(user, table="dead"),
+                "last_flush": s.get("last_flush"), "last_error": s.get("last_error")}
+
+    def dead(self, user=None):
+        return self.journal.dead(user)
+
+    def requeue(self, user):
+        n = self.journal.requeue(user)
+        self._wake.set()
+        return n
+
+    def discard(self, user):
+        return self.journal.discard(user)
+
+    def _note(self, users, **kw):
+        for u in set(users): self._status.setdefault(u, {}).update(kw)
+
+    def flush(self):
+        # Un blocco dal journal allo storage; False se il journal era vuoto
+        uid = self._suspect.pop(0) if self._suspect else None
+        batch, rowids, users = self.journal.take(uid=uid)
+        if not batch: return bool(self._suspect)
+        missing = []
+        try: self._store.update_fields(batch, missing=missing)
+        except Exception as e:
+            err = f"{time.strftime('%H:%M:%S')} {e}"
+            self._note(users.values(), last_error=err)
+            if is_transient(e) or isinstance(e, sqlite3.OperationalError):
+                if uid is not None: self._suspect.insert(0, uid)
+                raise  # le righe restano nel journal: il worker riprova con attesa crescente
+            if len(batch) > 1: self._suspect.extend(batch)
+            else: self.journal.bury(rowids[uid or next(iter(batch))], err)
+            return True
+        for m in missing: self.journal.bury(rowids.pop(m), NOT_FOUND)
+        self.journal.done([r for ids in rowids.values() for r in ids])
+        done = [uid for uid, f in batch.items() if uid in rowids and finishes(f)]
+        if done: self._archive_due.update(users[uid] for uid in done)
+        self._note(users.values(), last_flush=time.time(), last_error=None)
+        return True
+
+    def _run(self):
+        failures = 0
+        while True:
+            self._wake.wait(self.interval if not failures else min(MAX_BACKOFF, self.interval * 2 ** failures))
+            self._wake.clear()
+            # Ogni giro ha le sue statistiche: le chiamate a Sheets del worker finiscono nel log come "write-behind"
+            stats = perf.RerunStats(event="write-behind")
+            perf.attach(stats)
+            try:
+                with perf.section("flush"):
+                    while self.flush(): pass
+                if self._archive_due:
+                    due, self._archive_due = self._archive_due, set()
+                    try:
+                        with perf.section("archive"): self._store.archive_finished()
+                    except Exception as e:
+                        self._archive_due |= due
+                        self._note(due, last_error=f"{time.strftime('%H:%M:%S')} archivio: {e}")
+                        raise
+                    self._note(due, last_error=None)
+                failures = 0
+            except Exception:
+                failures += 1
+            finally:
+                perf.attach(None)
+                if stats.calls:  # i giri a vuoto non si registrano
+                    stats.close(interrupted=bool(failures))
+                    self.last_stats = stats
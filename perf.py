@@ -0,0 +1,111 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# --- STRUMENTAZIONE ---
+# Tempi per sezione dell'app e per chiamata allo storage / a Sheets, raccolti per singolo rerun.
+# A fine rerun (o all'inizio del successivo, se è stato interrotto da st.rerun / st.stop)
+# il riepilogo viene scritto nel log come JSON su una riga.
+log = logging.getLogger("lab_dashboard.perf")
+if not log.handlers:
+    _h = logging.StreamHandler()
+    _h.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    log.addHandler(_h)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+_local = threading.local()
+
+class RerunStats:
+    # event: "rerun" per l'app, "write-behind" per i giri del worker dei salvataggi (journal.py)
+    def __init__(self, user="", event="rerun"):
+        self.user = user
+        self.event = event
+        self.t0 = time.perf_counter()
+        self.sections = {}  # nome -> secondi
+        self.calls = {}     # nome -> [numero, secondi]
+        self.open = {}      # sezioni avviate con start() e non ancora chiuse
+        self.total = None
+        self.lock = threading.Lock()  # i thread di prefetch registrano in parallelo
+
+    def add_call(self, name, seconds):
+        with self.lock:
+            c = self.calls.setdefault(name, [0, 0.0])
+            c[0] += 1
+            c[1] += seconds
+
+    def close(self, interrupted=False):
+        now = time.perf_counter()
+        for name, t0 in self.open.items(): self.sections[name] = self.sections.get(name, 0.0) + now - t0
+        self.open = {}
+        self.total = now - self.t0
+        log.info(json.dumps({
+            "event": self.event, "user": self.user, "interrupted": interrupted,
+            "total_ms": round(self.total * 1000, 1),
+            "sections_ms": {k: round(v * 1000, 1) for k, v in self.sections.items()},
+            "calls": {k: {"n": n, "ms": round(s * 1000, 1)} for k, (n, s) in self.calls.items()},
+        }))
+
+def current():
+    return getattr(_local, "stats", None)
+
+def attach(stats):
+    # Per i thread di lavoro: registrano sulle statistiche del rerun che li ha avviati
+    _local.stats = stats
+
+def begin_rerun(state, user=""):
+    # state = st.session_state; chiude il rerun precedente se non è arrivato in fondo
+    prev = state.get("perf_current")
+    if prev is not None and prev.total is None:
+        prev.close(interrupted=True)
+        state["perf_last"] = prev
+    _local.stats = state["perf_current"] = RerunStats(user)
+
+def end_rerun(state):
+    stats = current()
+    if stats is None or stats.total is not None: return stats
+    stats.close()
+    state["perf_last"] = stats
+    return stats
+
+def start(name):
+    stats = current()
+    if stats is not None: stats.open[name] = time.perf_counter()
+
+def stop(name):
+    stats = current()
+    if stats is not None and name in stats.open:
+        stats.sections[name] = stats.sections.get(name, 0.0) + time.perf_counter() - stats.open.pop(name)
+
+@contextmanager
+def section(name):
+    start(name)
+    try: yield
+    finally: stop(name)
+
+def record_call(name, seconds):
+    stats = current()
+    if stats is not None: stats.add_call(name, seconds)
+
+class Instrumented:
+    # Proxy che cronometra ogni metodo pubblico dell'oggetto (es. lo storage)
+    def __init__(self, target, prefix):
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr): return attr
+        def call(*args, **kwargs):
+            t0 = time.perf_counter()
+            try: return attr(*args, **kwargs)
+            finally: record_call(f"{self._prefix}.{name}", time.perf_counter() - t0)
+        return call
+
+def summary_rows(stats):
+    # Righe per la tabella del pannello admin
+    rows = [{"Voce": f"sezione: {k}", "N": 1, "ms": round(v * 1000, 1)} for k, v in stats.sections.items()]
+    rows += [{"Voce": k, "N": n, "ms": round(s * 1000, 1)} for k, (n, s) in sorted(stats.calls.items(), key=lambda x: -x[1][1])]
+    return rows
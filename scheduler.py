@@ -0,0 +1,154 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from gspread.exceptions import APIError
+
+import perf
+
+# --- SCHEDULER RICHIESTE SHEETS ---
+# Ogni chiamata a gspread passa da qui: token bucket sulla quota al minuto,
+# retry con backoff esponenziale (con jitter) su 429/5xx ed errori di rete,
+# letture identiche nello stesso rerun servite una volta sola.
+# Le scritture che falliscono dopo i retry sollevano SheetsWriteError invece di sparire.
+# Le scritture non idempotenti (append, delete, add_worksheet, batch_update strutturale) si ripetono solo su 429:
+# dopo un timeout o un 5xx la chiamata potrebbe essere già stata applicata, e ripeterla duplicherebbe
+# righe o ne cancellerebbe altre. In quel caso SheetsWriteError, e il chiamante rilegge e riconcilia.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+NOT_APPLIED_STATUS = {429}
+COALESCE_WINDOW = 5.0  # secondi massimi di riuso di una lettura nello stesso rerun
+
+READ_METHODS = {"get_all_records", "get_all_values", "col_values", "row_values", "find", "batch_get", "worksheet", "worksheets"}
+WRITE_METHODS = {"append_row", "append_rows", "batch_update", "update", "update_cell", "delete_rows", "add_worksheet"}
+NON_IDEMPOTENT = {"append_row", "append_rows", "delete_rows", "add_worksheet"}
+
+class SheetsWriteError(Exception):
+    pass
+
+_fresh = threading.local()
+
+@contextmanager
+def fresh_reads():
+    # Letture che devono vedere il foglio di adesso (verifica delle righe prima di scrivere): niente riuso nel rerun
+    prev = getattr(_fresh, "on", False)
+    _fresh.on = True
+    try: yield
+    finally: _fresh.on = prev
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def _status(exc):
+    resp = getattr(exc, "response", None)
+    return getattr(resp, "status_code", None)
+
+def is_transient(exc):
+    # Errore di rete / quota / 5xx (anche avvolto in SheetsWriteError): riprovare più tardi può riuscire.
+    # Il resto (400, permessi, valori rifiutati) si ripeterebbe identico.
+    while exc is not None:
+        if isinstance(exc, requests.RequestException) or _status(exc) in RETRY_STATUS: return True
+        exc = exc.__cause__
+    return False
+
+class Scheduler:
+    def __init__(self, per_minute=60, burst=15, max_retries=5, base_delay=1.0, max_delay=32.0):
+        self.bucket = TokenBucket(per_minute, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._local = threading.local()
+        self._write_gen = 0  # ogni scrittura invalida le letture riusabili di tutti i thread
+
+    def begin_rerun(self):
+        self._local.reads = {}
+
+    def _retrying(self, fn, args, kwargs, idempotent=True):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try: return fn(*args, **kwargs)
+            except APIError as e:
+                if _status(e) not in (RETRY_STATUS if idempotent else NOT_APPLIED_STATUS) or attempt == self.max_retries: raise
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or attempt == self.max_retries: raise
+            time.sleep(min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def read(self, key, fn, *args, **kwargs):
+        reads = getattr(self._local, "reads", None)
+        if reads is not None and key is not None and not getattr(_fresh, "on", False):
+            hit = reads.get(key)
+            if hit and hit[0] == self._write_gen and time.monotonic() - hit[1] < COALESCE_WINDOW:
+                perf.record_call("sheets.coalesced", 0.0)
+                return hit[2]
+        out = self._retrying(fn, args, kwargs)
+        if reads is not None and key is not None: reads[key] = (self._write_gen, time.monotonic(), out)
+        return out
+
+    def write(self, fn, *args, idempotent=True, **kwargs):
+        self._write_gen += 1
+        try: return self._retrying(fn, args, kwargs, idempotent)
+        except (APIError, requests.RequestException) as e:
+            raise SheetsWriteError(f"{getattr(fn, '__name__', 'scrittura')}: {e}") from e
+        finally: self._write_gen += 1
+
+# --- PROXY GSPREAD ---
+def _key(obj, name, args, kwargs):
+    try: return (obj.id, name, repr(args), repr(sorted(kwargs.items())))
+    except Exception: return None
+
+class _Scheduled:
+    # Inoltra al gspread reale facendo passare le chiamate di rete dallo scheduler
+    non_idempotent = NON_IDEMPOTENT
+    def __init__(self, target, scheduler):
+        self._target = target
+        self._scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in READ_METHODS:
+            def call(*args, **kwargs):
+                t0 = time.perf_counter()
+                try: return self._wrap(self._scheduler.read(_key(self._target, name, args, kwargs), attr, *args, **kwargs))
+                finally: perf.record_call(f"sheets.{name}", time.perf_counter() - t0)
+            return call
+        if name in WRITE_METHODS:
+            def call(*args, **kwargs):
+                t0 = time.perf_counter()
+                try: return self._wrap(self._scheduler.write(attr, *args, idempotent=name not in self.non_idempotent, **kwargs))
+                finally: perf.record_call(f"sheets.{name}", time.perf_counter() - t0)
+            return call
+        return attr
+
+    def _wrap(self, out):
+        return out
+
+class ScheduledWorksheet(_Scheduled):
+    pass
+
+class ScheduledSpreadsheet(_Scheduled):
+    # Spreadsheet.batch_update invia richieste strutturali (es. deleteDimension), non valori
+    non_idempotent = NON_IDEMPOTENT | {"batch_update"}
+
+    def _wrap(self, out):
+        # worksheet / worksheets / add_worksheet restituiscono fogli: li avvolgo anche loro
+        if isinstance(out, list): return [self._wrap(w) for w in out]
+        if hasattr(out, "get_all_records"): return ScheduledWorksheet(out, self._scheduler)
+        return out
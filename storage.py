@@ -0,0 +1,514 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import rowcol_to_a1, a1_to_rowcol
+
+from scheduler import SheetsWriteError, fresh_reads
+
+# --- SCHEMA ---
+DB_SHEET = "DB_Respirometria"
+CATALOG_SHEET = "Catalog"  # Tipo ("project" / "tag") | Valore
+ARCHIVE_PREFIX = "DB_Archive_"  # partizioni fredde, una per anno (es. DB_Archive_2026)
+
+# Definiamo le colonne attese per evitare crash su DB vuoti
+EXPECTED_HEADERS = [
+    "ID_Univoco", "Project_Name", "Data", "Operatore", "Temperatura", "Pressione",
+    "Custom_Tags_JSON", "ID_Animale", "Siringa", "Elettrodo", "Tubo_Pompa",
+    "Falcon_Set", "Falcon_ID", "Peso_Vuoto", "Peso_Pieno", "Durata_Min", "Flow_Rate",
+    "SMR_1", "SMR_2", "Delta_Torr", "Watts", "Sex", "Body_Length", "Head_Length",
+    "Note", "Dry_Weight", "Stato"
+]
+
+# Mappa nome colonna -> indice (1-based) per le scritture a blocchi
+COL_IDX = {h: i + 1 for i, h in enumerate(EXPECTED_HEADERS)}
+BATCH_MAX_RANGES = 500  # range per singola chiamata batch_update
+USERS_MIN_REFRESH = 10  # secondi minimi tra due riletture forzate del foglio Users
+
+# Tipi del DataFrame in memoria: testo molto ripetuto -> category, misure -> float32
+# (celle vuote o non numeriche -> NaN), Data -> datetime, ID_Univoco -> stringa Arrow se disponibile.
+# Le altre colonne restano testo.
+CATEGORY_COLS = ["Project_Name", "Operatore", "Stato", "Sex", "Falcon_Set"]
+FLOAT_COLS = ["Temperatura", "Pressione", "Peso_Vuoto", "Peso_Pieno", "Durata_Min", "Flow_Rate",
+              "SMR_1", "SMR_2", "Delta_Torr", "Watts", "Body_Length", "Head_Length", "Dry_Weight"]
+DATE_COL = "Data"
+DATE_FORMAT = "%Y-%m-%d"
+
+def _id_dtype():
+    try:
+        import pyarrow
+        return pd.StringDtype("pyarrow")
+    except ImportError: return object
+
+ID_DTYPE = _id_dtype()
+
+def _to_dates(values):
+    if pd.api.types.is_datetime64_any_dtype(values): return values
+    raw = values.fillna("").astype(str).str.strip()
+    out = pd.to_datetime(raw, format="ISO8601", errors="coerce")
+    # Date in formato locale (es. 15/01/2024), se il foglio le ha riformattate
+    odd = out.isna() & (raw != "")
+    if odd.any(): out[odd] = pd.to_datetime(raw[odd], format="mixed", dayfirst=True, errors="coerce")
+    return out
+
+def typed_frame(df):
+    # Idempotente: si può riapplicare dopo un concat (che riporta le category a object)
+    for col in EXPECTED_HEADERS:
+        if col not in df.columns: df[col] = ""  # colonne mancanti nel foglio: vuote, per non crashare
+    for col in FLOAT_COLS:
+        if df[col].dtype != "float32": df[col] = pd.to_numeric(df[col], errors="coerce").astype("float32")
+    for col in CATEGORY_COLS:
+        if not isinstance(df[col].dtype, pd.CategoricalDtype): df[col] = df[col].fillna("").astype(str).astype("category")
+    df[DATE_COL] = _to_dates(df[DATE_COL])
+    if df["ID_Univoco"].dtype != ID_DTYPE: df["ID_Univoco"] = df["ID_Univoco"].fillna("").astype(str).astype(ID_DTYPE)
+    return df
+
+def records_to_frame(records):
+    # --- FIX SICUREZZA PER DATABASE VUOTO ---
+    # Se è vuoto, creiamo un DF vuoto ma con le colonne giuste per evitare KeyError
+    df = pd.DataFrame(records) if records else pd.DataFrame(columns=EXPECTED_HEADERS)
+    return typed_frame(df)
+
+def filter_records(df, operatore=None, project=None, exclude_stato=None):
+    mask = pd.Series(True, index=df.index)
+    if operatore is not None: mask &= df['Operatore'] == operatore
+    if project is not None: mask &= df['Project_Name'] == project
+    if exclude_stato is not None: mask &= df['Stato'] != exclude_stato
+    return df[mask].copy()
+
+def tags_from_json(raw_values):
+    unique_tags = set()
+    for item in raw_values:
+        if item and item != "{}":
+            try:
+                js = json.loads(item)
+                unique_tags.update(js.keys())
+            except: pass
+    return sorted(list(unique_tags))
+
+# --- PARTIZIONI ---
+# Nel foglio di lavoro restano SETUP/IN_CORSO e gli archiviati ancora senza Dry_Weight;
+# un esperimento archiviato e pesato è concluso e passa nella partizione del suo anno.
+def finished_mask(df):
+    return (df['Stato'] == 'ARCHIVIATO') & pd.to_numeric(df['Dry_Weight'], errors='coerce').notna()
+
+def archive_period(data_value):
+    # Anno dalla cella Data così com'è nel foglio (2024-01-15, 15/01/2024, ...)
+    m = re.search(r"(?<!\d)\d{4}(?!\d)", str(data_value))
+    return m.group(0) if m else time.strftime("%Y")
+
+def row_blocks(rows):
+    # Righe ordinate -> blocchi contigui [inizio, fine]
+    blocks = []
+    for r in rows:
+        if blocks and r == blocks[-1][1] + 1: blocks[-1][1] = r
+        else: blocks.append([r, r])
+    return blocks
+
+def catalog_from_pairs(pairs):
+    cat = {"project": set(), "tag": set()}
+    for row in pairs:
+        if len(row) >= 2 and row[0] in cat and row[1] != "": cat[row[0]].add(str(row[1]))
+    return cat
+
+# --- INTERFACCIA ---
+class Storage:
+    # Operazioni usate dall'app; ogni backend le implementa tutte.
+    # update_fields riceve {ID_Univoco: {colonna: valore}} e restituisce quante righe ha aggiornato.
+    name = ""
+
+    # include_archive=True legge anche le partizioni archiviate (solo per l'export)
+    def list_records(self, operatore=None, project=None, exclude_stato=None, include_archive=False): raise NotImplementedError
+    def append_rows(self, rows): raise NotImplementedError
+    # Gli ID che non trova li aggiunge a missing, se è una lista
+    def update_fields(self, updates, missing=None): raise NotImplementedError
+    # Sposta gli esperimenti conclusi nelle partizioni d'archivio; restituisce quante righe ha spostato
+    def archive_finished(self): raise NotImplementedError
+    # Catalogo di progetti e tag: poche righe aggiornate quando se ne creano di nuovi
+    def project_names(self): raise NotImplementedError
+    def unique_tags(self): raise NotImplementedError
+    def add_to_catalog(self, projects=(), tags=()): raise NotImplementedError
+    def get_user(self, username, refresh=False): raise NotImplementedError
+    def save_session(self, username, start_time_str, project): raise NotImplementedError
+    def load_session(self, username): raise NotImplementedError
+    def clear_session(self, username): raise NotImplementedError
+    def invalidate(self): pass
+    # Marcatore che cambia quando i dati letti possono essere cambiati (per le cache di ciò che se ne ricava)
+    def data_version(self): return None
+
+# --- SCRITTURA A BLOCCHI ---
+def _range_entry(r, run):
+    a1 = rowcol_to_a1(r, run[0][0])
+    if len(run) > 1: a1 += ":" + rowcol_to_a1(r, run[-1][0])
+    return {"range": a1, "values": [[v for _, v in run]]}
+
+def build_batch_data(updates):
+    # updates = {riga: {colonna: valore}} -> un range A1 per ogni blocco di colonne contigue
+    data = []
+    for r in sorted(updates):
+        cols = sorted(((COL_IDX[k], v) for k, v in updates[r].items()), key=lambda x: x[0])
+        run = []
+        for c, v in cols:
+            if run and c != run[-1][0] + 1:
+                data.append(_range_entry(r, run))
+                run = []
+            run.append((c, v))
+        if run: data.append(_range_entry(r, run))
+    return data
+
+def batch_write(ws, updates):
+    # Tutte le celle modificate in una (o poche) chiamate invece di un update_cell per cella
+    data = build_batch_data(updates)
+    for i in range(0, len(data), BATCH_MAX_RANGES):
+        ws.batch_update(data[i:i + BATCH_MAX_RANGES], value_input_option="USER_ENTERED")
+    return len(data)
+
+# --- INDICE RIGHE ---
+class RowIndex:
+    # Chiave della colonna key_col -> numero di riga, costruito con una sola lettura della colonna.
+    # Condiviso tra sessioni, quindi protetto da lock. Prima di scrivere si usa resolve(), che rilegge la colonna:
+    # il foglio può essere stato riordinato o modificato a mano o da un'altra istanza dell'app.
+    # Chi scrive tiene idx.lock tra resolve e scrittura, così le cancellazioni di questo processo non si intromettono.
+    # Per DB_SHEET serve solo a questo (lock + resolve). La mappa in cache, letta con get() in O(1) senza
+    # chiamate di rete e tenuta aggiornata da add(), la usa soltanto load_session su Active_Sessions.
+    def __init__(self, key_col=1):
+        self.key_col = key_col
+        self.rows = None
+        self.n_rows = 0  # righe occupate, header incluso
+        self.lock = threading.RLock()
+
+    def _build(self, ws):
+        with fresh_reads(): vals = ws.col_values(self.key_col)
+        self.rows = {str(v): i + 1 for i, v in enumerate(vals) if i > 0 and v != ""}
+        self.n_rows = len(vals)
+
+    def resolve(self, ws, keys):
+        # Righe verificate adesso (una lettura): {chiave: riga o None}
+        with self.lock:
+            try: self._build(ws)
+            except Exception as e:  # senza verifica non si scrive
+                self.rows = None
+                raise SheetsWriteError(f"verifica righe non riuscita: {e}") from e
+            return {str(k): self.rows.get(str(k)) for k in keys}
+
+    def get(self, ws, key):
+        key = str(key)
+        with self.lock:
+            if self.rows is None: self._build(ws)
+            elif key not in self.rows: self._build(ws)  # righe aggiunte da altri: ricostruisco una volta
+            return self.rows.get(key)
+
+    def add(self, keys, append_resp):
+        # Aggiornamento in place dopo append_rows, usando il range restituito dall'API
+        try: start = a1_to_rowcol(append_resp["updates"]["updatedRange"].split("!")[-1].split(":")[0])[0]
+        except: start = None
+        with self.lock:
+            if self.rows is None: return
+            if start != self.n_rows + 1:
+                self.rows = None  # righe spostate rispetto all'indice: ricostruzione al prossimo accesso
+                return
+            for i, k in enumerate(keys): self.rows[str(k)] = start + i
+            self.n_rows = start + len(keys) - 1
+
+    def invalidate(self):
+        with self.lock: self.rows = None
+
+# --- BACKEND GOOGLE SHEETS ---
+class SheetsStorage(Storage):
+    name = "sheets"
+
+    def __init__(self, sh, ttl=60, users_ttl=300):
+        self.sh = sh
+        self.ttl = ttl
+        self.users_ttl = users_ttl
+        self._ws_cache = {}
+        self._index = {DB_SHEET: RowIndex(), "Active_Sessions": RowIndex()}
+        self._lock = threading.Lock()
+        self._df = None
+        self._df_ts = 0.0
+        self._arch_df = None
+        self._arch_ts = 0.0
+        self._cat = None
+        self._cat_ts = 0.0
+        self._cat_lock = threading.Lock()
+        self._users = None
+        self._users_ts = 0.0
+        self._users_lock = threading.Lock()
+
+    def ws(self, title):
+        # Handle dei fogli memorizzati: niente richiesta di metadati ad ogni rerun
+        if title not in self._ws_cache: self._ws_cache[title] = self.sh.worksheet(title)
+        return self._ws_cache[title]
+
+    # Copia di DB_Respirometria condivisa tra sessioni, valida per ttl secondi
+    def _frame(self):
+        with self._lock:
+            if self._df is None or time.monotonic() - self._df_ts > self.ttl:
+                self._df = records_to_frame(self.ws(DB_SHEET).get_all_records())
+                self._df_ts = time.monotonic()
+            return self._df
+
+    def _archive_frame(self):
+        with self._lock:
+            if self._arch_df is None or time.monotonic() - self._arch_ts > self.ttl:
+                parts = [records_to_frame(w.get_all_records()) for w in self.sh.worksheets() if w.title.startswith(ARCHIVE_PREFIX)]
+                self._arch_df = typed_frame(pd.concat(parts, ignore_index=True)) if parts else records_to_frame([])
+                self._arch_ts = time.monotonic()
+            return self._arch_df
+
+    def invalidate(self):
+        # Ricarica completa (pulsante in Export): foglio di lavoro, archivio e catalogo
+        with self._lock: self._df, self._arch_df = None, None
+        with self._cat_lock: self._cat = None
+
+    def _invalidate_live(self):
+        # Dopo le proprie scritture sul foglio di lavoro: archivio e catalogo non sono cambiati
+        with self._lock: self._df = None
+
+    def data_version(self):
+        # Istante dell'ultima rilettura di foglio di lavoro e archivio
+        return (self._df_ts, self._arch_ts)
+
+    def list_records(self, operatore=None, project=None, exclude_stato=None, include_archive=False):
+        df = self._frame()
+        if include_archive: df = typed_frame(pd.concat([df, self._archive_frame()], ignore_index=True))
+        return filter_records(df, operatore, project, exclude_stato)
+
+    def append_rows(self, rows):
+        self.ws(DB_SHEET).append_rows(rows)
+        self._invalidate_live()
+
+    def update_fields(self, updates, missing=None):
+        ws = self.ws(DB_SHEET)
+        idx = self._index[DB_SHEET]
+        with idx.lock:
+            rows = idx.resolve(ws, updates)
+            by_row = {rows[str(uid)]: fields for uid, fields in updates.items() if rows[str(uid)]}
+            if by_row: batch_write(ws, by_row)
+        if missing is not None: missing.extend(str(uid) for uid in updates if not rows[str(uid)])
+        if by_row: self._invalidate_live()
+        return len(by_row)
+
+    def archive_finished(self):
+        # Si copiano le celle così come sono nel foglio: il frame tipizzato (float32, date) serve solo a scegliere le righe
+        values = self.ws(DB_SHEET).get_all_values()
+        if len(values) < 2: return 0
+        header, body = values[0], [r + [""] * (len(values[0]) - len(r)) for r in values[1:]]
+        mask = finished_mask(typed_frame(pd.DataFrame(body, columns=header))).to_numpy()
+        if not mask.any(): return 0
+        pos = [header.index(h) if h in header else None for h in EXPECTED_HEADERS]
+        done = [[r[p] if p is not None else "" for p in pos] for r, m in zip(body, mask) if m]
+        parts = {}
+        for rec in done: parts.setdefault(archive_period(rec[COL_IDX["Data"] - 1]), []).append(rec)
+        # 1. Copia nelle partizioni (saltando ciò che c'è già, se un giro precedente si è interrotto)
+        for period, part in sorted(parts.items()):
+            title = ARCHIVE_PREFIX + period
+            try: ws_a = self.ws(title)
+            except WorksheetNotFound:
+                ws_a = self.sh.add_worksheet(title, rows=1000, cols=len(EXPECTED_HEADERS))
+                self._ws_cache[title] = ws_a
+            ids_a = ws_a.col_values(1)
+            existing, header_a = set(ids_a), ([] if ids_a else [EXPECTED_HEADERS])  # vuota anche se creata da un giro fallito
+            new = [rec for rec in part if rec[0] not in existing]
+            # USER_ENTERED: i numeri letti come testo formattato tornano numeri
+            if header_a or new: ws_a.append_rows(header_a + new, value_input_option="USER_ENTERED")
+        # 2. Rimozione dal foglio di lavoro: righe verificate sulla colonna A appena riletta,
+        # cancellate con un'unica batch_update di blocchi contigui dal basso
+        ws = self.ws(DB_SHEET)
+        idx = self._index[DB_SHEET]
+        try:
+            with idx.lock:
+                rows = sorted(r for r in idx.resolve(ws, {rec[0] for rec in done}).values() if r)
+                reqs = [{"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": start - 1, "endIndex": end}}}
+                        for start, end in reversed(row_blocks(rows))]
+                for i in range(0, len(reqs), BATCH_MAX_RANGES):
+                    self.sh.batch_update({"requests": reqs[i:i + BATCH_MAX_RANGES]})
+        finally:
+            # Anche se la cancellazione si interrompe: le righe già tolte non devono restare nelle cache
+            with self._lock: self._df, self._arch_df = None, None
+        return len(rows)
+
+    # Scansioni complete, usate solo per inizializzare il foglio Catalog
+    def _scan_project_names(self):
+        try:
+            col_vals = self.ws(DB_SHEET).col_values(2)
+            if len(col_vals) > 1: return sorted(set(col_vals[1:]) - {""})
+        except: pass
+        return []
+
+    def _scan_tags(self):
+        try: return tags_from_json(self.ws(DB_SHEET).col_values(7)[1:])
+        except: return []
+
+    def _catalog(self):
+        with self._cat_lock:
+            if self._cat is None or time.monotonic() - self._cat_ts > self.ttl:
+                try: pairs = self.ws(CATALOG_SHEET).get_all_values()[1:]
+                except WorksheetNotFound:
+                    pairs = [["project", p] for p in self._scan_project_names()] + [["tag", t] for t in self._scan_tags()]
+                    ws = self.sh.add_worksheet(CATALOG_SHEET, rows=max(len(pairs) + 100, 1000), cols=2)
+                    self._ws_cache[CATALOG_SHEET] = ws
+                    ws.append_rows([["Tipo", "Valore"]] + pairs)
+                self._cat = catalog_from_pairs(pairs)
+                self._cat_ts = time.monotonic()
+            return self._cat
+
+    def project_names(self):
+        try: return sorted(self._catalog()["project"])
+        except: return []
+
+    def unique_tags(self):
+        try: return sorted(self._catalog()["tag"])
+        except: return []
+
+    def add_to_catalog(self, projects=(), tags=()):
+        cat = self._catalog()
+        new = [["project", p] for p in dict.fromkeys(projects) if p and p not in cat["project"]]
+        new += [["tag", t] for t in dict.fromkeys(tags) if t and t not in cat["tag"]]
+        if not new: return
+        self.ws(CATALOG_SHEET).append_rows(new)
+        with self._cat_lock:
+            for kind, value in new: cat[kind].add(value)
+
+    # Rubrica utenti indicizzata per username, valida users_ttl secondi.
+    # refresh=True la rilegge subito (utente nuovo o password cambiata), al massimo una volta ogni USERS_MIN_REFRESH
+    # secondi per non consumare quota con tentativi a raffica.
+    def get_user(self, username, refresh=False):
+        with self._users_lock:
+            age = time.monotonic() - self._users_ts
+            if self._users is None or age > self.users_ttl or (refresh and age > USERS_MIN_REFRESH):
+                self._users = {str(u.get('Username', '')).strip(): u for u in self.ws("Users").get_all_records()}
+                self._users_ts = time.monotonic()
+            return self._users.get(str(username).strip())
+
+    def save_session(self, username, start_time_str, project):
+        ws = self.ws("Active_Sessions")
+        idx = self._index["Active_Sessions"]
+        with idx.lock:
+            r = idx.resolve(ws, [username])[username]
+            if r: ws.update(range_name=f"B{r}:C{r}", values=[[start_time_str, project]])
+            else: idx.add([username], ws.append_row([username, start_time_str, project]))
+
+    def load_session(self, username, _retry=True):
+        ws = self.ws("Active_Sessions")
+        idx = self._index["Active_Sessions"]
+        try:
+            r = idx.get(ws, username)
+            if r:
+                vals = ws.row_values(r)
+                if vals and vals[0] != username and _retry:  # indice non allineato al foglio
+                    idx.invalidate()
+                    return self.load_session(username, _retry=False)
+                if len(vals) >= 3 and vals[0] == username: return vals[1], vals[2]
+        except: pass
+        return None, None
+
+    def clear_session(self, username):
+        ws = self.ws("Active_Sessions")
+        idx = self._index["Active_Sessions"]
+        with idx.lock:
+            try:
+                r = idx.resolve(ws, [username])[username]
+                if r: ws.delete_rows(r)
+            finally: idx.invalidate()  # le righe sotto sono scalate
+
+# --- BACKEND SQLITE ---
+class SQLiteStorage(Storage):
+    # Stesse colonne del foglio, con indici sui campi usati nei filtri.
+    # Gli utenti vanno inseriti a mano nella tabella users (password generate con: python auth.py <password>).
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        cols = ", ".join(f'"{h}"' + (" PRIMARY KEY" if h == "ID_Univoco" else "") for h in EXPECTED_HEADERS)
+        with self._lock, self.conn:
+            for table in ("records", "archive"):
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+                for col in ("Operatore", "Stato", "Project_Name"):
+                    self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{col.lower()} ON {table} ("{col}")')
+            self.conn.execute("CREATE TABLE IF NOT EXISTS users (Username PRIMARY KEY, Password, Nome_Completo)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS active_sessions (Username PRIMARY KEY, Start_Time, Project)")
+            if not self.conn.execute("SELECT name FROM sqlite_master WHERE name = 'catalog'").fetchall():
+                self.conn.execute("CREATE TABLE catalog (Tipo, Valore, PRIMARY KEY (Tipo, Valore))")
+                # Inizializzazione dai dati già presenti
+                self.conn.execute('INSERT OR IGNORE INTO catalog SELECT DISTINCT \'project\', "Project_Name" FROM records WHERE "Project_Name" != \'\'')
+                tags = tags_from_json(r[0] for r in self.conn.execute('SELECT DISTINCT "Custom_Tags_JSON" FROM records'))
+                self.conn.executemany("INSERT OR IGNORE INTO catalog VALUES ('tag', ?)", [(t,) for t in tags])
+
+    def data_version(self):
+        # Modifiche fatte da questa connessione + commit di altre connessioni sullo stesso file
+        with self._lock: return (self.conn.total_changes, self.conn.execute("PRAGMA data_version").fetchone()[0])
+
+    def _query(self, sql, params=()):
+        with self._lock: return self.conn.execute(sql, params).fetchall()
+
+    def list_records(self, operatore=None, project=None, exclude_stato=None, include_archive=False):
+        where, params = [], []
+        if operatore is not None: where.append('"Operatore" = ?'); params.append(operatore)
+        if project is not None: where.append('"Project_Name" = ?'); params.append(project)
+        if exclude_stato is not None: where.append('"Stato" != ?'); params.append(exclude_stato)
+        cond = " WHERE " + " AND ".join(where) if where else ""
+        sql = "SELECT * FROM records" + cond
+        if include_archive:
+            sql += " UNION ALL SELECT * FROM archive" + cond
+            params = params * 2
+        rows = self._query(sql, params)
+        return typed_frame(pd.DataFrame([tuple(r) for r in rows], columns=EXPECTED_HEADERS))
+
+    def append_rows(self, rows):
+        marks = ", ".join("?" * len(EXPECTED_HEADERS))
+        with self._lock, self.conn:
+            self.conn.executemany(f"INSERT INTO records VALUES ({marks})", rows)
+
+    def update_fields(self, updates, missing=None):
+        n = 0
+        with self._lock, self.conn:
+            for uid, fields in updates.items():
+                cols = [c for c in fields if c in COL_IDX]
+                if not cols: continue
+                sets = ", ".join(f'"{c}" = ?' for c in cols)
+                cur = self.conn.execute(f'UPDATE records SET {sets} WHERE "ID_Univoco" = ?',
+                                        [fields[c] for c in cols] + [str(uid)])
+                n += cur.rowcount
+                if not cur.rowcount and missing is not None: missing.append(str(uid))
+        return n
+
+    def archive_finished(self):
+        # Un'unica tabella d'archivio: con gli indici non serve partizionare per anno
+        done = """"Stato" = 'ARCHIVIATO' AND typeof("Dry_Weight") IN ('integer', 'real')"""
+        with self._lock, self.conn:
+            self.conn.execute(f"INSERT OR IGNORE INTO archive SELECT * FROM records WHERE {done}")
+            return self.conn.execute(f"DELETE FROM records WHERE {done}").rowcount
+
+    def project_names(self):
+        return [r[0] for r in self._query("SELECT Valore FROM catalog WHERE Tipo = 'project' ORDER BY 1")]
+
+    def unique_tags(self):
+        return [r[0] for r in self._query("SELECT Valore FROM catalog WHERE Tipo = 'tag' ORDER BY 1")]
+
+    def add_to_catalog(self, projects=(), tags=()):
+        rows = [("project", p) for p in projects if p] + [("tag", t) for t in tags if t]
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO catalog VALUES (?, ?)", rows)
+
+    def get_user(self, username, refresh=False):
+        rows = self._query("SELECT * FROM users WHERE Username = ?", (str(username).strip(),))
+        return dict(rows[0]) if rows else None
+
+    def save_session(self, username, start_time_str, project):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO active_sessions VALUES (?, ?, ?)", (username, start_time_str, project))
+
+    def load_session(self, username):
+        rows = self._query("SELECT Start_Time, Project FROM active_sessions WHERE Username = ?", (username,))
+        return (rows[0][0], rows[0][1]) if rows else (None, None)
+
+    def clear_session(self, username):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM active_sessions WHERE Username = ?", (username,))